@@ -1,190 +1,532 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 import json
-import matplotlib.pyplot as plt
-import statistics as st
-
-
-# extracts and organizes timestamp data into timestamp-based discrete lane categories with car
-# information (x-coordinate, y-coordinate, car id)
-def organize_by_car(data):
-    lanes = {'E1': [0, 12], 'E2': [12, 24], 'E3': [24, 36], 'E4': [36, 48], 'E5': [48, 60],
-             'E6': [60, 72], 'W1': [72, 84], 'W2': [84, 96], 'W3': [96, 108], 'W4': [108, 120],
-             'W5': [120, 132], 'W6': [132, 144]}
-    for set in data:
-        by_car = {'E1': [], 'E2': [], 'E3': [], 'E4': [], 'E5': [], 'E6': [], 'W1': [], 'W2': [],
-                    'W3': [], 'W4': [], 'W5': [], 'W6': []}
-        pos = set['position']
-        id = set['id']
-        for i in range(len(id)):
-            x, y = pos[i]
-            carid = list(id[i].values())[0]
-            for key, ranges in lanes.items():
-                # sorting by lane
-                if ranges[0] < y <= ranges[1]:
-                    by_car[key].append((x, y, carid))
-                    break
-        set['by car'] = by_car
-
-
-# organizes timestamp-based lane category data by x-coordinate of car
-def organize_by_x(data):
-    # where each set is a timestamp
-    for set in data:
-        # where key is lane number, values are list of cars on lane
-        for key, values in set['by car'].items():
-
-            # sort each lane in the time stamp by x position
-            values.sort(key = lambda x:x[0])
-
-
-# transforms data into dictionary of car trajectories and includes leader vehicle of each car at
-# each time stamp
-def get_car_leaders(data, by_car_by_timestamp):
-    for set in data:
-        time = set['timestamp']
-
-        for key, values in set['by car'].items():
-
-            # where car is each car on lane
-            for idx, car in enumerate(values):
-
-                car_id = car[2]
-
-                if idx == len(values) - 1:
-                    leader = None
-                else:
-                    leader = values[idx + 1][2]
-
-                if not by_car_by_timestamp.get(car_id):
-                    by_car_by_timestamp[car_id] = {'leader': []}
-
-                cur_car_leader = by_car_by_timestamp[car_id]['leader']
-                cur_car_leader.append([leader, time])
-            # print(by_car_by_timestamp[car_id]['leader'])
-
-
-# combines information of individual car leaders and transforms data to be (car leader, beginning
-# time stamp, end time stamp)
-def combine_car_leaders(by_car_by_timestamp):
-
-    # for each car trajectory
-    for car, items in by_car_by_timestamp.items():
-        cur_leader = None
-        start_time = None
-        lst = []
-
-        # for each leader w/in car trajectory
-        for idx, leader in enumerate(items['leader']):
-            # if no values
-            if start_time == None:
-                cur_leader = leader[0]
-                start_time = leader[1]
-
-            # leader change, add prev leader tuple
-            elif leader[0] != cur_leader or idx == len(items['leader']) - 1:
-                lst.append((cur_leader, start_time, leader[1]))
-                cur_leader = leader[0]
-                start_time = leader[1]
-
-        items['leader'] = lst
-
-
-# calculates follow distance of cars from leaders, and store as car_id: (leader, distance, time)
-# finds follow distance every second to avoid taking up too much space
-def calculate_follow_distance(data, by_car_by_timestamp):
-    counter = 0
-    for set in data:
-        if counter%25 != 0:
-            counter += 1
+import os
+from operator import itemgetter
+import numpy as np
+
+from columnar import close_table, open_table, read_table, write_rows
+from frame_store import intern_ids, iter_frame_dicts, num_frames, slice_frames
+from instrument import finish_trace, iter_stage, new_trace, stage
+from lanes import DEFAULT_LANE_INDEX, LANES, build_lane_index, classify_lanes
+from leader_index import build_leader_index, save_leader_index
+from plots import bar_chart, bar_panel
+from running_stats import (QUANTILE_ACCURACY, add_values, histogram_bars, new_accumulator,
+                           percentile_line, stdev)
+from stages import add_stage, evaluate, new_graph, stage_key
+from trajectory_store import shard_bounds
+
+# widths of the histogram bins of follow distance, in feet, and of its rate of change, in feet per
+# second
+FOLLOW_DISTANCE_BIN_WIDTH = 50
+FOLLOW_DISTANCE_CHANGE_BIN_WIDTH = 2
+
+# follow distance samples per second taken by the tracker, on a grid of sampling times starting at
+# the first timestamp. None keeps the follow distance of every timestamp, stored as float32
+FOLLOW_DISTANCE_RATE = 1
+
+# rows written at a time by create_newfile_columns
+NEW_FILE_CHUNK_ROWS = 1 << 20
+
+# timestamps closer than this to a sampling time, in seconds, are sampled as they are rather than
+# interpolated
+SAMPLE_TOLERANCE = 1e-6
+
+# sort key of the (x pos, y pos, car id) entries of a lane
+X_POSITION = itemgetter(0)
+
+# leader of a car at the front of its lane, and marker of a car off the road or without an open
+# leader interval, in the lists and columns of interned cars
+NO_LEADER = -1
+UNTRACKED = -2
+
+# timestamp chunks per worker of track_chunked, so workers that finish early pick up more
+CHUNKS_PER_WORKER = 4
+
+# stage graph of main, kept between calls so unchanged stages are not recomputed
+_graph = None
+
+# frame store shared by the tasks of a worker process of track_chunked
+_worker_frames = None
+
+
+# sorts the cars of a single timestamp into lanes, as (x, y, car) where car is the index of the
+# car's id in the frame's 'ids' if its ids are interned and the car id otherwise
+def organize_frame_by_car(set, lane_index=DEFAULT_LANE_INDEX):
+    names = lane_index['names']
+    by_car = {name: [] for name in names}
+    pos = set['position']
+    car = set.get('car')
+    if car is None:
+        car = [next(iter(id.values())) for id in set['id']]
+
+    # sorting by lane
+    lane = classify_lanes([y for x, y in pos], lane_index).tolist()
+    for i in range(len(car)):
+        if lane[i] < 0:
             continue
-        time = set['timestamp']
-        for key, values in set['by car'].items():
-            # key, values in format lane, [(x pos, y pos, car id), ...]
-            for idx, value in enumerate(values[:-1]):
-                x = value[0]
-                car = value[2]
-                leader = values[idx+1][2]
-                leader_x = values[idx+1][0]
-                if not by_car_by_timestamp[car].get('follow distance'):
-                    by_car_by_timestamp[car]['follow distance'] = []
-                by_car_by_timestamp[car]['follow distance'].append((leader, leader_x-x, time))
-        counter += 1
-
-
-# prints basic stats including distribution of follow distances
-def print_follow_distance_distribution(by_car_by_timestamp):
-    dic = {}
-    lst=[]
-    for car in by_car_by_timestamp:
-        if not by_car_by_timestamp[car].get('follow distance'): continue
-        follow_dist = by_car_by_timestamp[car]['follow distance']
-
-        for tuple in follow_dist:
-            dist = round(tuple[1]/50) * 50
-            dic[dist] = dic.get(dist,0)+1
-            lst.append(tuple[1])
+        x, y = pos[i]
+        by_car[names[lane[i]]].append((x, y, car[i]))
+    set['by car'] = by_car
+
+
+# creates the order of the cars in every lane carried from one timestamp to the next by
+# order_frame_by_x, for timestamps with interned car ids: the cars of each lane in x order, the
+# leader of every car indexed by car (NO_LEADER at the front of its lane, UNTRACKED off the road)
+# and the timestamp each car was last placed at, as well as the cars that entered the road at the
+# latest timestamp (with their leader) and those that left it
+def new_lane_order():
+    return {'lanes': {}, 'leaders': [], 'placed': [], 'frame': 0, 'entered': {}, 'left': []}
+
+
+# sorts each lane of a single timestamp by x-coordinate of car and carries the order of every lane
+# over to the next timestamp. cars rarely enter, leave or pass each other between timestamps, so
+# most lanes keep their order and only the lanes whose order changed have their leaders updated.
+# returns the cars still on the road whose leader changed, as car: (old leader, new leader)
+def order_frame_by_x(set, lane_order):
+    lanes, leaders, placed = lane_order['lanes'], lane_order['leaders'], lane_order['placed']
+    lane_order['frame'] += 1
+    frame = lane_order['frame']
+    missing = len(set['ids']) - len(leaders)
+    if missing > 0:
+        leaders.extend([UNTRACKED]*missing)
+        placed.extend([0]*missing)
+    changes, entered, left = {}, {}, []
+
+    for key, values in set['by car'].items():
+        values.sort(key=X_POSITION)
+        cars = [car[2] for car in values]
+        previous = lanes.get(key, [])
+        if cars == previous:
+            continue
+
+        lanes[key] = cars
+        left.extend(previous)
+        for car, leader in zip(cars, cars[1:] + [NO_LEADER]):
+            old = leaders[car]
+            if old == UNTRACKED:
+                entered[car] = leader
+            elif old != leader:
+                changes[car] = (old, leader)
+            leaders[car] = leader
+            placed[car] = frame
+
+    # cars that left the lanes they were in without showing up in another one left the road
+    left = [car for car in left if placed[car] != frame]
+    for car in left:
+        leaders[car] = UNTRACKED
+    lane_order['entered'], lane_order['left'] = entered, left
+    return changes
+
+
+# returns the follow distance of every car with a leader at a single timestamp as the lists of cars
+# and of their leaders and an array of distances. the lanes, each sorted by x, are laid end to end
+# so the gaps of all of them are one difference, leaving out the front car of every lane
+def frame_follow_distances(set):
+    lanes = [values for values in set['by car'].values() if len(values) > 1]
+    rows = [car for values in lanes for car in values]
+    x = np.array([car[0] for car in rows], dtype=np.float64)
+
+    follower = np.ones(len(rows), dtype=bool)
+    follower[np.cumsum([len(values) for values in lanes], dtype=np.int64) - 1] = False
+    follower = np.flatnonzero(follower)
+    return ([rows[i][2] for i in follower.tolist()], [rows[i+1][2] for i in follower.tolist()],
+            x[follower+1] - x[follower])
+
+
+# creates an online leader tracker fed one timestamp at a time by track_frame, with cars interned as
+# indexes into 'ids'. a car leaves once missing for more than exit_after timestamps, and follow
+# distances are sampled follow_rate times per second, or at every timestamp if it is None
+def new_tracker(lane_index=DEFAULT_LANE_INDEX, exit_after=None, follow_rate=FOLLOW_DISTANCE_RATE,
+                trace=None):
+    return {
+        'lane_index': lane_index,
+        'trace': trace,
+        'exit_after': exit_after,
+        'follow rate': follow_rate,
+        'samples': 0,
+        'ids': [],
+        'id index': {},
+        # cars in the order they were first tracked
+        'cars': [],
+        # open interval of every car, indexed by car: 'open leader' is UNTRACKED without one and
+        # 'open frame' -1 for a car never tracked. closed intervals are columns of 'intervals'
+        'open leader': [],
+        'open start': [],
+        'open frame': [],
+        'intervals': {'car': array('i'), 'leader': array('i'), 'start': array('d'),
+                      'end': array('d')},
+        'follow': {'car': array('i'), 'leader': array('i'),
+                   'distance': array('f' if follow_rate is None else 'd'), 'time': array('d')},
+        'frames': 0,
+        'time': None,
+        'lane order': new_lane_order(),
+        'lanes': {},
+        # timestamp and frame at which every car out of view was last seen
+        'away': {},
+    }
 
 
+# gives the cars of a timestamp their index in the tracker's table of car ids. timestamps whose
+# ids are already interned, such as those of frame_store.iter_frame_dicts, bring their own table,
+# which the tracker takes over at the first of them
+def intern_frame(tracker, set):
+    if 'car' not in set:
+        set['car'] = intern_ids(set['id'], tracker['ids'], tracker['id index'])
+        set['ids'] = tracker['ids']
+    elif set['ids'] is not tracker['ids']:
+        if tracker['ids']:
+            raise ValueError('the timestamps of a scene must share one table of car ids')
+        tracker['ids'] = set['ids']
+        tracker['id index'] = {car_id: car for car, car_id in enumerate(set['ids'])}
+
+    missing = len(tracker['ids']) - len(tracker['open leader'])
+    if missing > 0:
+        tracker['open leader'].extend([UNTRACKED]*missing)
+        tracker['open start'].extend([0.0]*missing)
+        tracker['open frame'].extend([-1]*missing)
+
+
+# adds a single timestamp to the tracker and returns the cars whose leader changed at it, as
+# car: (old leader, new leader)
+def track_frame(tracker, set):
+    trace = tracker['trace']
+    changes = order_frame(tracker, set)
+    lane_order = tracker['lane order']
+    with stage(trace, 'leader_intervals'):
+        update_leader_intervals(tracker, set['timestamp'], lane_order['entered'],
+                                lane_order['left'], changes)
+    with stage(trace, 'sample_follow_distances'):
+        sample_follow_distances(tracker, set)
+    next_frame(tracker, set['timestamp'], set['by car'])
+    return changes
+
+
+# interns, sorts into lanes and orders the cars of a timestamp, carrying the order of the lanes
+# over from the previous timestamp, and returns the cars whose leader changed as order_frame_by_x
+def order_frame(tracker, set):
+    trace = tracker['trace']
+    with stage(trace, 'organize_by_car', len(set['position'])):
+        intern_frame(tracker, set)
+        organize_frame_by_car(set, tracker['lane_index'])
+    with stage(trace, 'order_frame_by_x'):
+        return order_frame_by_x(set, tracker['lane order'])
+
+
+# moves the tracker past a timestamp at time with lanes, closing the cars missing for too long
+def next_frame(tracker, time, lanes):
+    tracker['frames'] += 1
+    tracker['time'] = time
+    tracker['lanes'] = lanes
+
+    if tracker['exit_after'] is not None:
+        frame = tracker['frames'] - 1
+        for car in [car for car, (last_seen, last_frame) in tracker['away'].items()
+                    if frame - last_frame > tracker['exit_after']]:
+            close_tracked_car(tracker, car)
+
+
+# opens, continues and closes the leader intervals of the cars of a timestamp at time given the
+# cars that entered the road at it (with their leader), those that left it and those whose leader
+# changed. cars that came back into view with another leader are added to the changes
+def update_leader_intervals(tracker, time, entered, left, changes):
+    frame = tracker['frames']
+    open_leader, open_start = tracker['open leader'], tracker['open start']
+    open_frame, away = tracker['open frame'], tracker['away']
+
+    for car in left:
+        away[car] = (tracker['time'], frame - 1)
+
+    for car, leader in entered.items():
+        if open_leader[car] == UNTRACKED:
+            if open_frame[car] < 0:
+                tracker['cars'].append(car)
+            open_leader[car], open_start[car], open_frame[car] = leader, time, frame
+            continue
+
+        # a car back in view after missing some timestamps keeps its interval if its leader is the
+        # same, and otherwise closes it
+        del away[car]
+        if leader != open_leader[car]:
+            changes[car] = (open_leader[car], leader)
+
+    # leader change, close the interval of the previous leader
+    for car, (old, leader) in changes.items():
+        add_leader_interval(tracker, car, time)
+        open_leader[car], open_start[car], open_frame[car] = leader, time, frame
+
+
+# adds the open leader interval of a car, ending at end, to the tracker's intervals
+def add_leader_interval(tracker, car, end):
+    intervals = tracker['intervals']
+    intervals['car'].append(car)
+    intervals['leader'].append(tracker['open leader'][car])
+    intervals['start'].append(tracker['open start'][car])
+    intervals['end'].append(end)
+
+
+# samples the follow distances of a timestamp added to the tracker. at full resolution every
+# timestamp is kept. otherwise every sampling time up to the timestamp is sampled: a timestamp on
+# it as it is, and between two timestamps by interpolating the follow distance of the cars that
+# followed the same leader at both
+def sample_follow_distances(tracker, set):
+    time, rate = set['timestamp'], tracker['follow rate']
+    if rate is None:
+        add_follow_samples(tracker, *frame_follow_distances(set), time)
+        return
+
+    if tracker['frames'] == 0:
+        tracker['origin'] = time
+    while True:
+        sample_time = tracker['origin'] + tracker['samples']/rate
+        if time < sample_time - SAMPLE_TOLERANCE:
+            return
+        if time <= sample_time + SAMPLE_TOLERANCE:
+            add_follow_samples(tracker, *frame_follow_distances(set), time)
+        else:
+            add_follow_samples(tracker, *interpolate_follow_distances(
+                tracker['lanes'], tracker['time'], set, sample_time), sample_time)
+        tracker['samples'] += 1
+
+
+# returns the follow distances at sample_time, between the previous timestamp (with lanes
+# previous_lanes) and set, of the cars that followed the same leader at both
+def interpolate_follow_distances(previous_lanes, previous_time, set, sample_time):
+    before = frame_follow_distances({'by car': previous_lanes})
+    before = {car: (leader, distance) for car, leader, distance in
+              zip(before[0], before[1], before[2].tolist())}
+    cars, leaders, distances = frame_follow_distances(set)
+
+    rows = [i for i, (car, leader) in enumerate(zip(cars, leaders))
+            if before.get(car, (None,))[0] == leader]
+    start = np.array([before[cars[i]][1] for i in rows], dtype=np.float64)
+    weight = (sample_time - previous_time)/(set['timestamp'] - previous_time)
+    return ([cars[i] for i in rows], [leaders[i] for i in rows],
+            start + weight*(distances[rows] - start))
+
+
+# appends follow distance samples taken at time to the tracker's columns
+def add_follow_samples(tracker, cars, leaders, distances, time):
+    follow = tracker['follow']
+    follow['car'].extend(cars)
+    follow['leader'].extend(leaders)
+    follow['distance'].frombytes(np.asarray(distances, dtype=follow['distance'].typecode).tobytes())
+    follow['time'].extend([time]*len(cars))
+
+
+# returns the follow distances sampled by the tracker as columns car, leader, distance and time
+# sorted by car then time, with car i occupying offsets[i]:offsets[i+1]. car and leader are indexes
+# into 'ids'
+def follow_distance_table(tracker):
+    return car_table(tracker, tracker['follow'])
+
+
+# returns the closed leader intervals of the tracker as columns car, leader, start and end sorted
+# by car then start, with car i occupying offsets[i]:offsets[i+1]. car and leader are indexes into
+# 'ids', with NO_LEADER for no leader
+def leader_interval_table(tracker):
+    return car_table(tracker, tracker['intervals'])
+
+
+# turns columns of the tracker appended in time order into numpy columns sorted by car, along with
+# the car ids and the offsets of every car's rows
+def car_table(tracker, columns):
+    columns = {name: np.array(column) for name, column in columns.items()}
+    order = np.argsort(columns['car'], kind='stable')
+    table = {name: column[order] for name, column in columns.items()}
+    table['ids'] = tracker['ids']
+    table['offsets'] = np.searchsorted(table['car'], np.arange(len(tracker['ids'])+1))
+    return table
+
+
+# closes the open leader interval of a car that left at the last timestamp it was seen. an interval
+# opened on that timestamp has no duration and is dropped
+def close_tracked_car(tracker, car):
+    last_seen, last_frame = tracker['away'].pop(car, (tracker['time'], tracker['frames'] - 1))
+    if last_frame > tracker['open frame'][car]:
+        add_leader_interval(tracker, car, last_seen)
+    tracker['open leader'][car] = UNTRACKED
+
+
+# returns the current state of every car with an open interval: its leader, since when it has
+# followed it, its follow distance at the latest timestamp (None if it is out of view), and when it
+# was last seen
+def current_state(tracker):
+    distances = {}
+    for values in tracker['lanes'].values():
+        for car, leader in zip(values, values[1:]):
+            distances[car[2]] = leader[0] - car[0]
+
+    ids, away = tracker['ids'], tracker['away']
+    open_leader, open_start = tracker['open leader'], tracker['open start']
+    return {ids[car]: {'leader': ids[open_leader[car]] if open_leader[car] >= 0 else None,
+                       'since': open_start[car], 'follow distance': distances.get(car),
+                       'last seen': away[car][0] if car in away else tracker['time']}
+            for car in tracker['cars'] if open_leader[car] != UNTRACKED}
+
+
+# closes the intervals of every car still in view and returns the leaders and follow distances of
+# all cars in the form car_id: {'leader': [(leader, start, end)], 'follow distance': [...]}, with
+# the car ids restored. at full resolution the follow distances are left out and only kept in
+# follow_distance_table
+def finish_tracker(tracker):
+    for car in tracker['cars']:
+        if tracker['open leader'][car] != UNTRACKED:
+            close_tracked_car(tracker, car)
+
+    # NO_LEADER, the last index, is no car
+    ids = tracker['ids']
+    names = ids + [None]
+    by_car_by_timestamp = {}
+    table = leader_interval_table(tracker)
+    offsets = table['offsets'].tolist()
+    leader = [names[code] for code in table['leader'].tolist()]
+    start, end = table['start'].tolist(), table['end'].tolist()
+    for car in tracker['cars']:
+        lo, hi = offsets[car], offsets[car+1]
+        by_car_by_timestamp[ids[car]] = {'leader': list(zip(leader[lo:hi], start[lo:hi],
+                                                            end[lo:hi]))}
+
+    if tracker['follow rate'] is not None:
+        table = follow_distance_table(tracker)
+        offsets = table['offsets'].tolist()
+        leader = [names[code] for code in table['leader'].tolist()]
+        distance, time = table['distance'].tolist(), table['time'].tolist()
+        for car in tracker['cars']:
+            lo, hi = offsets[car], offsets[car+1]
+            if hi > lo:
+                by_car_by_timestamp[ids[car]]['follow distance'] = list(
+                    zip(leader[lo:hi], distance[lo:hi], time[lo:hi]))
+    return by_car_by_timestamp
+
+
+# number of follow distance sampling times, starting at origin with `rate` per second, that the
+# tracker has sampled once it has been fed a timestamp at time
+def samples_until(origin, rate, time):
+    samples = max(int((time - origin)*rate) - 1, 0)
+    while not time < origin + samples/rate - SAMPLE_TOLERANCE:
+        samples += 1
+    return samples
+
+
+# initializes a worker process with the frame store its chunks share
+def set_worker_frames(frames):
+    global _worker_frames
+    _worker_frames = frames
+
+
+# tracks a frame store in chunks of consecutive timestamps over `workers` processes and returns
+# the tracker as track_frame leaves it, stitching leader intervals across chunks afterwards
+def track_chunked(frames, lane_index=DEFAULT_LANE_INDEX, exit_after=None,
+                  follow_rate=FOLLOW_DISTANCE_RATE, workers=1, trace=None):
+    chunks = shard_bounds(frames, workers*CHUNKS_PER_WORKER)
+    origin = float(frames['timestamp'][0]) if num_frames(frames) else None
+    tasks = [(first, last, lane_index, follow_rate, origin) for first, last in chunks]
+    with stage(trace, 'track_chunked', len(frames['car'])):
+        with ProcessPoolExecutor(workers, initializer=set_worker_frames,
+                                 initargs=(frames,)) as pool:
+            parts = list(pool.map(track_worker_chunk, tasks))
+
+        tracker = new_tracker(lane_index, exit_after, follow_rate, trace)
+        intern_frame(tracker, {'car': [], 'ids': list(frames['ids'])})
+        timestamp = frames['timestamp'].tolist()
+        for (first, last), part in zip(chunks, parts):
+            events = {frame: event for frame, *event in part['events']}
+            for frame in range(first, last):
+                if frame in events:
+                    update_leader_intervals(tracker, timestamp[frame], *events[frame])
+                next_frame(tracker, timestamp[frame], part['lanes'])
+            for name, column in part['follow'].items():
+                tracker['follow'][name].extend(column)
+        if parts:
+            tracker['origin'], tracker['samples'] = origin, parts[-1]['samples']
+    return tracker
+
+
+# orders the lanes of one chunk of the worker's frame store and samples its follow distances,
+# returning them with the cars that entered, left or changed leader at every timestamp of the
+# chunk, as (frame, entered, left, changes). the timestamp before the chunk is ordered first, so
+# the order of the lanes and the lanes follow distances are interpolated from are the ones
+# track_frame would have at the start of the chunk
+def track_worker_chunk(task):
+    first, last, lane_index, follow_rate, origin = task
+    tracker = new_tracker(lane_index, follow_rate=follow_rate)
+    frames = iter_frame_dicts(slice_frames(_worker_frames, max(first-1, 0), last))
+    if first > 0:
+        set = next(frames)
+        order_frame(tracker, set)
+        tracker['time'], tracker['lanes'] = set['timestamp'], set['by car']
+        tracker['origin'] = origin
+        if follow_rate is not None:
+            tracker['samples'] = samples_until(origin, follow_rate, set['timestamp'])
+    tracker['frames'] = first
+
+    events = []
+    lane_order = tracker['lane order']
+    for set in frames:
+        changes = order_frame(tracker, set)
+        if lane_order['entered'] or lane_order['left'] or changes:
+            events.append((tracker['frames'], lane_order['entered'], lane_order['left'], changes))
+        sample_follow_distances(tracker, set)
+        next_frame(tracker, set['timestamp'], set['by car'])
+    return {'events': events, 'follow': tracker['follow'], 'lanes': tracker['lanes'],
+            'samples': tracker['samples']}
+
+
+# prints basic stats including distribution of follow distances, from the follow distance table of
+# the tracker
+def print_follow_distance_distribution(by_car_by_timestamp, follow, accuracy=QUANTILE_ACCURACY):
+    acc = add_values(new_accumulator(FOLLOW_DISTANCE_BIN_WIDTH, accuracy), follow['distance'])
+
     print(f'across {len(by_car_by_timestamp)} trajectories, there was an:\n- average follow '
-          f'distance of {st.mean(lst):.2f} feet\n - maximum: {max(lst):.2f}\n - minimum: {min(lst):.2f}\n'
-          f' - standard deviation {st.stdev(lst):.2f}')
+          f'distance of {acc["mean"]:.2f} feet\n - maximum: {acc["max"]:.2f}\n - minimum: '
+          f'{acc["min"]:.2f}\n - standard deviation {stdev(acc):.2f}')
+    print(percentile_line(acc))
 
     print("graphed information of distributions of follow distance: ")
 
-    # include values of follow distance that had 0 frequency so dictionary has keys of equal
-    # intervals
-    for i in range(min(dic.keys()), max(dic.keys())+1, 50):
-        dic[i] = dic.get(i,0)
-    plt.rcParams.update({'font.size': 6})
-    sort_dict = dict(sorted(dic.items()))
-    names = list(sort_dict.keys())
-    values = list(sort_dict.values())
-
-    plt.bar(range(len(sort_dict)), values, tick_label=names)
-    plt.ylabel("frequency")
-    plt.xlabel("follow distance (feet)")
-    plt.title("distribution of follow distances")
-    plt.show()
+    # include values of follow distance that had 0 frequency so bars are of equal intervals
+    names, values = histogram_bars(acc)
+    bar_chart("follow_distance_distribution",
+              [bar_panel(values, "follow distance (feet)", "frequency",
+                         "distribution of follow distances", tick_labels=names)], font_size=6)
     print()
 
 
-# prints basic stats including distribution of the change in follow distances
-def print_follow_distance_change_distribution(by_car_by_timestamp):
-    dic = {}
-    lst = []
-    for car in by_car_by_timestamp:
-        if not by_car_by_timestamp[car].get('follow distance'): continue
-        follow_dist = by_car_by_timestamp[car]['follow distance']
-        for idx, tuple in enumerate(follow_dist[:-1]):
-            # only if same car
-            if tuple[0] != follow_dist[idx+1][0]: continue
-            diff = tuple[1] - follow_dist[idx+1][1]
-            lst.append(diff)
-            diff = round(diff/2)*2
-            dic[diff] = dic.get(diff, 0)+1
-
-    # include values of follow distance change that had 0 frequency so dictionary has keys of
-    # equal intervals
-    for i in range(min(dic.keys()), max(dic.keys())+1, 2):
-        dic[i] = dic.get(i,0)
+# prints basic stats including distribution of the rate of change in follow distances between
+# consecutive samples of a car, from the follow distance table of the tracker
+def print_follow_distance_change_distribution(by_car_by_timestamp, follow,
+                                              accuracy=QUANTILE_ACCURACY):
+    acc = add_values(new_accumulator(FOLLOW_DISTANCE_CHANGE_BIN_WIDTH, accuracy),
+                     follow_distance_changes(follow))
 
     print(f'across {len(by_car_by_timestamp)} trajectories, there was an:\n- average follow '
-          f'distance change of {st.mean(lst):.2f} feet/sec\n - maximum: {max(lst):.2f}\n - '
-          f'minimum: {min(lst):.2f}\n - standard deviation {st.stdev(lst):.2f}')
+          f'distance change of {acc["mean"]:.2f} feet/sec\n - maximum: {acc["max"]:.2f}\n - '
+          f'minimum: {acc["min"]:.2f}\n - standard deviation {stdev(acc):.2f}')
+    print(percentile_line(acc))
 
     print("graphed information of distributions of follow distance: ")
 
-    plt.rcParams.update({'font.size': 6})
-    sort_dict = dict(sorted(dic.items()))
-    names = list(sort_dict.keys())
-    values = list(sort_dict.values())
+    # include values of follow distance change that had 0 frequency so bars are of equal intervals
+    names, values = histogram_bars(acc)
+    bar_chart("follow_distance_change_distribution",
+              [bar_panel(values, "change in follow distance (feet/sec)", "frequency",
+                         "distribution of change in follow distances", tick_labels=names)],
+              font_size=6)
+    print()
 
-    plt.bar(range(len(sort_dict)), values, tick_label=names)
-    plt.ylabel("frequency")
-    plt.xlabel("change in follow distance (feet)")
-    plt.title("distribution of change in follow distances")
 
-    plt.show()
-    print()
+# returns the rate of change in follow distance, in feet per second, between consecutive samples
+# of the same car behind the same leader, from the follow distance table of the tracker. changes
+# are divided by the time between the samples, so they are in the same units at any sampling rate
+def follow_distance_changes(follow):
+    car, leader = follow['car'], follow['leader']
+    dist = follow['distance'].astype(np.float64)
+    elapsed = follow['time'][1:] - follow['time'][:-1]
+
+    # only if same car and same leader
+    same_leader = (car[:-1] == car[1:]) & (leader[:-1] == leader[1:]) & (elapsed > 0)
+    return (dist[:-1] - dist[1:])[same_leader]/elapsed[same_leader]
 
 
 # dumps data organized by trajectory into a new json file
@@ -192,24 +534,179 @@ def create_newfile_dictionary(new_file, by_car_by_timestamp):
     new_file.write(json.dumps(by_car_by_timestamp, indent=4))
 
 
-# runs the functions in analysis_by_timestamp
-def main(data):
-    by_car_by_timestamp = {}
+# writes the leaders and follow distances of all cars to the directory at path as two columnar
+# tables: 'leader' with columns car, leader, start and end, and 'follow distance' with columns car,
+# leader, distance and time. cars and leaders are indexes into the car ids in path/ids.json, or -1
+# for no leader, and rows are sorted by car. follow is the follow distance table of the tracker.
+# rows are written NEW_FILE_CHUNK_ROWS at a time
+def create_newfile_columns(path, by_car_by_timestamp, follow):
+    os.makedirs(path, exist_ok=True)
+    ids = list(by_car_by_timestamp)
+    id_index = {car_id: i for i, car_id in enumerate(ids)}
+    id_index[None] = -1
+
+    writer = open_table(os.path.join(path, 'leader'), {'car': np.int32, 'leader': np.int32,
+                                                      'start': np.float64, 'end': np.float64})
+    rows = []
+    for car, car_id in enumerate(ids):
+        rows.extend((car, id_index[leader], start, end)
+                    for leader, start, end in by_car_by_timestamp[car_id]['leader'])
+        if len(rows) >= NEW_FILE_CHUNK_ROWS or car == len(ids) - 1:
+            columns = np.array(rows, dtype=np.float64).reshape(-1, 4).T
+            write_rows(writer, dict(zip(['car', 'leader', 'start', 'end'], columns)))
+            rows = []
+    close_table(writer)
+
+    # the cars of the follow distance table are indexes into the tracker's own ids, which also hold
+    # cars that were never in a lane and so have no rows
+    codes = np.array([id_index.get(car_id, -1) for car_id in follow['ids']] + [-1],
+                     dtype=np.int32)
+    car = codes[follow['car']]
+    order = np.argsort(car, kind='stable')
+    writer = open_table(os.path.join(path, 'follow distance'), {
+        'car': np.int32, 'leader': np.int32, 'distance': follow['distance'].dtype,
+        'time': np.float64})
+    for first in range(0, len(order), NEW_FILE_CHUNK_ROWS):
+        chunk = order[first:first+NEW_FILE_CHUNK_ROWS]
+        write_rows(writer, {'car': car[chunk], 'leader': codes[follow['leader'][chunk]],
+                            'distance': follow['distance'][chunk], 'time': follow['time'][chunk]})
+    close_table(writer)
+
+    with open(os.path.join(path, 'ids.json'), 'w') as f:
+        json.dump(ids, f)
+
+
+# opens the tables written by create_newfile_columns, memory-mapped, as
+# {'ids': [...], 'leader': columns, 'follow distance': columns}
+def read_newfile_columns(path):
+    with open(os.path.join(path, 'ids.json')) as f:
+        results = {'ids': json.load(f)}
+    for table in 'leader', 'follow distance':
+        results[table] = read_table(os.path.join(path, table))[0]
+    return results
+
+
+# turns tables read by read_newfile_columns back into the form car_id: {'leader': [(leader, start,
+# end)], 'follow distance': [(leader, distance, time)]}
+def columns_to_dictionary(results):
+    ids = results['ids']
+    by_car_by_timestamp = {car_id: {'leader': []} for car_id in ids}
+    for table, time_columns in (('leader', ('start', 'end')),
+                                ('follow distance', ('distance', 'time'))):
+        columns = results[table]
+        rows = zip(columns['car'].tolist(), columns['leader'].tolist(),
+                   *(columns[name].tolist() for name in time_columns))
+        for car, leader, first, second in rows:
+            by_car_by_timestamp[ids[car]].setdefault(table, []).append(
+                (ids[leader] if leader >= 0 else None, first, second))
+    return by_car_by_timestamp
+
+
+# tracks every timestamp of data and returns the leaders and follow distances of all cars, as
+# finish_tracker returns them, along with the follow distance table of the tracker. data may be a
+# frame store, which is tracked in chunks over `workers` processes with track_chunked when there
+# are several
+def track_scene(data, lanes=LANES, follow_rate=FOLLOW_DISTANCE_RATE, trace=None, workers=1):
+    lane_index = build_lane_index(lanes)
+    if is_frame_store(data) and workers > 1:
+        tracker = track_chunked(data, lane_index, follow_rate=follow_rate, workers=workers,
+                                trace=trace)
+    else:
+        if is_frame_store(data):
+            data = iter_frame_dicts(data)
+        tracker = new_tracker(lane_index, follow_rate=follow_rate, trace=trace)
+
+        # data may be a stream of timestamps, so each one is fully processed and then let go
+        for set in iter_stage(trace, 'load', data):
+            track_frame(tracker, set)
+    with stage(trace, 'finish_tracker'):
+        return finish_tracker(tracker), follow_distance_table(tracker)
+
+
+# whether data is a frame store rather than timestamps
+def is_frame_store(data):
+    return isinstance(data, dict) and 'offsets' in data
+
+
+# leader index of the results of track_scene
+def leader_index_stage(tracked):
+    return build_leader_index(*tracked)
+
+
+# returns the stage graph of main: load -> track -> leader index. the graph is built once and kept,
+# so results of one call of main are reused by the next
+def analysis_graph(cache_dir=None):
+    global _graph
+    if _graph is None:
+        _graph = new_graph()
+        add_stage(_graph, 'track', track_scene, ['load'], ['lanes', 'follow_rate'],
+                  ['trace', 'workers'])
+        add_stage(_graph, 'leader index', leader_index_stage, ['track'])
+    _graph['cache dir'] = cache_dir
+    return _graph
+
+
+# runs the functions in analysis_by_timestamp. data is a list or any other iterable of timestamps,
+# such as scene_io.iter_frames, or a frame store, whose timestamps are tracked over `workers`
+# processes; results are the same for any number. source_key identifies the content of data, such
+# as trajectory_store.store_key of the store the timestamps come from; with it the tracking and
+# the index are stages of analysis_graph, and calling main again on the same data only redoes the
+# report and files. the results of memoized stages are shared with later calls and are not modified
+def main(data, lanes=LANES, source_key=None, workers=1):
     config = {
         'create_new_file': 0,
+        # 'columnar' writes compact memory-mappable tables (see create_newfile_columns), 'json' one
+        # indented json document
+        'new_file_format': 'columnar',
+        'create_index': 0,
         'print': 1,
+        'follow_distance_rate': FOLLOW_DISTANCE_RATE,
+        # relative accuracy of the reported follow distance percentiles (see running_stats)
+        'quantile_accuracy': QUANTILE_ACCURACY,
+        # time every stage and write a json trace of the run to instrument.TRACE_DIR, optionally
+        # tracing python memory allocations too
+        'instrument': 0,
+        'instrument_memory': 0,
+        # also keep the results of every stage in this directory (such as stages.CACHE_DIR), so
+        # later runs on the same scene skip them. needs source_key
+        'stage_cache_dir': None,
     }
 
-    organize_by_car(data)
-    organize_by_x(data)
-    get_car_leaders(data, by_car_by_timestamp)
-    combine_car_leaders(by_car_by_timestamp)
-    calculate_follow_distance(data, by_car_by_timestamp)
+    trace = (new_trace('analysis_by_timestamp', config['instrument_memory']) if config['instrument']
+             else None)
+    graph = analysis_graph(config['stage_cache_dir'])
+    sources = {'load': (data, source_key)}
+    params = {'lanes': lanes, 'follow_rate': config['follow_distance_rate'], 'trace': trace,
+              'workers': workers}
+    by_car_by_timestamp, follow = evaluate(graph, 'track', params, sources, trace)
 
     if config['print']:
-        print_follow_distance_distribution(by_car_by_timestamp)
-        print_follow_distance_change_distribution(by_car_by_timestamp)
+        with stage(trace, 'print_follow_distance_distribution'):
+            print_follow_distance_distribution(by_car_by_timestamp, follow,
+                                               config['quantile_accuracy'])
+        with stage(trace, 'print_follow_distance_change_distribution'):
+            print_follow_distance_change_distribution(by_car_by_timestamp, follow,
+                                                      config['quantile_accuracy'])
 
     if config['create_new_file']:
-        with open('groundtruth_scene_1_130__cajoles_transformed_by_car.json', 'w') as new_file:
-            create_newfile_dictionary(new_file, by_car_by_timestamp)
\ No newline at end of file
+        with stage(trace, 'create_new_file'):
+            if config['new_file_format'] == 'columnar':
+                create_newfile_columns(
+                    'groundtruth_scene_1_130__cajoles_transformed_by_car.columns',
+                    by_car_by_timestamp, follow)
+            else:
+                with open('groundtruth_scene_1_130__cajoles_transformed_by_car.json',
+                          'w') as new_file:
+                    create_newfile_dictionary(new_file, by_car_by_timestamp)
+
+    # index of the leader intervals and follow distances for time-based queries with leader_index
+    if config['create_index']:
+        with stage(trace, 'create_index'):
+            # from the tracking above, which a stream can't be read again for
+            tracked = ((by_car_by_timestamp, follow), stage_key(graph, 'track', params, sources))
+            save_leader_index('groundtruth_scene_1_130__cajoles_leader_index.npz',
+                              evaluate(graph, 'leader index', params,
+                                       {**sources, 'track': tracked}, trace))
+
+    if trace is not None:
+        finish_trace(trace)
@@ -0,0 +1,297 @@
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import analysis_by_timestamp
+import scene_cache
+import scene_io
+import speed_accel_indiv
+from frame_store import iter_frame_dicts, num_frames
+from lanes import LANES, build_lane_index
+from running_stats import (QUANTILE_ACCURACY, accumulator_from_dict, accumulator_to_dict,
+                           add_group_summaries, add_values, merge_accumulators, new_accumulator,
+                           quantiles, stdev)
+from trajectory_store import build_trajectory_store, num_cars
+from transpose import frames_from_trajectories
+
+# where the summary of every scene is kept, so scenes that haven't changed since the last batch
+# are skipped
+RESULTS_DIR = '.batch_results'
+
+# bumped whenever the summaries change, so older ones are recomputed
+RESULTS_VERSION = 2
+
+# files the pipelines write next to the scenes, which are not scenes themselves
+OUTPUT_SUFFIXES = ('_transformed_by_car.json',)
+
+BRAKE_BOUNDARY, ACCEL_BOUNDARY = -3, 2.25
+
+
+# returns the scene files matching the given directories (every .json file in them) and glob
+# patterns, in order and without repeats
+def find_scenes(patterns):
+    scenes = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = sorted(glob.glob(os.path.join(pattern, '*.json')))
+            paths = [path for path in paths if not path.endswith(OUTPUT_SUFFIXES)]
+        else:
+            paths = sorted(glob.glob(pattern))
+        scenes.extend(path for path in paths if path not in scenes)
+    return scenes
+
+
+# the parameters summaries depend on; a cached summary is only used if they are unchanged
+def batch_params(BRAKE_BOUNDARY, ACCEL_BOUNDARY, lanes=LANES,
+                 follow_rate=analysis_by_timestamp.FOLLOW_DISTANCE_RATE,
+                 accuracy=QUANTILE_ACCURACY):
+    params = {'version': RESULTS_VERSION, 'brake': BRAKE_BOUNDARY, 'accel': ACCEL_BOUNDARY,
+              'lanes': lanes, 'follow_rate': follow_rate, 'quantile_accuracy': accuracy,
+              'conditional_window': speed_accel_indiv.CONDITIONAL_WINDOW}
+    # as it reads back from json, so tuples and lists compare equal
+    return json.loads(json.dumps(params))
+
+
+# returns the cached summary of a scene, or None if there is none for the current version of the
+# scene file and params
+def cached_summary(path, key, params, results_dir=RESULTS_DIR):
+    cached = scene_cache.read_json(os.path.join(results_dir, f"{key['sha256']}.json"), None)
+    if (cached is None or cached['sha256'] != key['sha256'] or cached['size'] != key['size']
+            or cached['params'] != params):
+        return None
+    return summary_from_json(cached['summary'])
+
+
+# keeps the summary of a scene for later batches
+def save_summary(path, key, params, summary, results_dir=RESULTS_DIR):
+    os.makedirs(results_dir, exist_ok=True)
+    scene_cache.write_json(os.path.join(results_dir, f"{key['sha256']}.json"), {
+        'scene': os.path.abspath(path), 'sha256': key['sha256'], 'size': key['size'],
+        'params': params, 'summary': summary_to_json(summary)})
+
+
+# runs both pipelines on a scene in a worker process and returns its summary
+def analyze_scene(task):
+    path, params, use_cache, cache_dir = task
+    if use_cache:
+        store = scene_cache.load_trajectory_store(path, cache_dir)
+    else:
+        store = build_trajectory_store(scene_io.iter_trajectories(path))
+    frames = frames_from_trajectories(store)
+    lane_index = build_lane_index(params['lanes'])
+
+    results = speed_accel_indiv.analyze_trajectories(store, params['brake'], params['accel'],
+                                                     lane_index, params['quantile_accuracy'])
+
+    tracker = analysis_by_timestamp.new_tracker(lane_index, follow_rate=params['follow_rate'])
+    for set in iter_frame_dicts(frames):
+        analysis_by_timestamp.track_frame(tracker, set)
+    analysis_by_timestamp.finish_tracker(tracker)
+    follow = analysis_by_timestamp.follow_distance_table(tracker)
+
+    return summarize_scene(store, num_frames(frames), results, follow, lane_index,
+                           params['quantile_accuracy'])
+
+
+# reduces the results of both pipelines on a scene to totals and accumulators that merge across
+# scenes with merge_summaries: sums of the per-trajectory values the reports average, and the
+# running statistics, histograms and quantile sketches (of the given accuracy) of speed,
+# acceleration and follow distances
+def summarize_scene(store, frames, results, follow, lane_index, accuracy=QUANTILE_ACCURACY):
+    lanes_per_car = results['lanes per car']
+    lane = results['lane']
+    summary = {
+        'scenes': 1,
+        'cars': num_cars(store),
+        'samples': int(len(store['timestamp'])),
+        'frames': frames,
+        'speed': add_group_summaries(
+            new_accumulator(speed_accel_indiv.SPEED_BIN_WIDTH, accuracy), results['speed']),
+        'accel': add_group_summaries(
+            new_accumulator(speed_accel_indiv.ACCEL_BIN_WIDTH, accuracy), results['accel']),
+        'events': {},
+        'conditional': {name: float(np.sum(column))
+                        for name, column in results['conditional'].items()},
+        'with lane changes': int(np.count_nonzero(lanes_per_car > 1)),
+        'lane changes': int(lanes_per_car.sum() - len(lanes_per_car)),
+        'lanes': np.bincount(lane[lane >= 0], minlength=len(lane_index['names'])).tolist(),
+        'follow distance': add_values(
+            new_accumulator(analysis_by_timestamp.FOLLOW_DISTANCE_BIN_WIDTH, accuracy),
+            follow['distance']),
+        'follow distance change': add_values(
+            new_accumulator(analysis_by_timestamp.FOLLOW_DISTANCE_CHANGE_BIN_WIDTH, accuracy),
+            analysis_by_timestamp.follow_distance_changes(follow)),
+    }
+    for var in speed_accel_indiv.AXES:
+        summary['events'][var] = {name: float(np.sum(column))
+                                  for name, column in results[var].items()}
+    return summary
+
+
+# merges the summaries of several scenes in order: counts and sums are added up, lane counts added
+# lane by lane and accumulators merged
+def merge_summaries(parts):
+    first = parts[0]
+    if isinstance(first, dict) and 'm2' in first:
+        merged = new_accumulator(first['width'], first['accuracy'])
+        for part in parts:
+            merge_accumulators(merged, part)
+        return merged
+    if isinstance(first, dict):
+        return {key: merge_summaries([part[key] for part in parts]) for key in first}
+    if isinstance(first, list):
+        return [sum(counts) for counts in zip(*parts)]
+    return sum(parts)
+
+
+# returns a summary as json-serializable values
+def summary_to_json(summary):
+    if 'm2' in summary:
+        return accumulator_to_dict(summary)
+    return {key: summary_to_json(value) if isinstance(value, dict) else value
+            for key, value in summary.items()}
+
+
+# rebuilds a summary from summary_to_json
+def summary_from_json(summary):
+    if 'm2' in summary:
+        return accumulator_from_dict(summary)
+    return {key: summary_from_json(value) if isinstance(value, dict) else value
+            for key, value in summary.items()}
+
+
+# the headline statistics of a summary, as reported for every scene and for the pool
+def summary_statistics(summary):
+    conditional = summary['conditional']
+    ttl = summary['events']['ttl']
+    return {
+        'cars': summary['cars'],
+        'speed': summary['speed']['mean'],
+        'speed sd': stdev(summary['speed']),
+        'speed p85': quantiles(summary['speed'], [0.85])[0],
+        'accel': summary['accel']['mean'],
+        'accel sd': stdev(summary['accel']),
+        '# accel': int(ttl['# accel']),
+        '# brake': int(ttl['# brake']),
+        'P(B|A)': speed_accel_indiv.ratio(conditional['B given A'],
+                                          conditional['B given A occurrences']),
+        'P(A|B)': speed_accel_indiv.ratio(conditional['A given B'],
+                                          conditional['A given B occurrences']),
+        'lane changes': summary['lane changes'],
+        'follow distance': summary['follow distance']['mean'],
+        'follow distance p5': quantiles(summary['follow distance'], [0.05])[0],
+        'follow distance change': summary['follow distance change']['mean'],
+    }
+
+
+# prints one line per scene and one for the pool of all scenes that succeeded
+def print_report(scenes, pooled):
+    print(f"{'scene':<40} {'status':>7} {'cars':>7} {'speed':>7} {'p85':>7} {'accel':>7} "
+          f"{'# accel':>8} {'# brake':>8} {'P(B|A)':>8} {'P(A|B)':>8} {'lc':>6} {'follow':>8} "
+          f"{'p5':>8}")
+    for path, scene in scenes.items():
+        name = os.path.basename(path)[:40]
+        if scene['summary'] is None:
+            print(f"{name:<40} {'failed':>7} {scene['error']}")
+        else:
+            print(f"{name:<40} {scene['status']:>7} " + statistics_line(scene['summary']))
+    if pooled is not None:
+        print(f"{'pooled':<40} {pooled['scenes']:>7} " + statistics_line(pooled))
+    print()
+
+
+# formats the headline statistics of a summary for print_report
+def statistics_line(summary):
+    stats = summary_statistics(summary)
+    return (f"{stats['cars']:>7} {stats['speed']:>7.2f} {stats['speed p85']:>7.2f} "
+            f"{stats['accel']:>7.2f} {stats['# accel']:>8} {stats['# brake']:>8} "
+            f"{100*stats['P(B|A)']:>7.2f}% {100*stats['P(A|B)']:>7.2f}% {stats['lane changes']:>6} "
+            f"{stats['follow distance']:>8.2f} {stats['follow distance p5']:>8.2f}")
+
+
+# runs both pipelines on every scene over a pool of at most `workers` processes, each working on
+# one scene at a time. scenes with a cached summary for the same scene file and params are not
+# run again unless force is set. returns {path: {'status', 'summary', 'error'}} in scene order and
+# the pooled summary of all scenes that succeeded, merged in scene order
+def run_batch(scenes, BRAKE_BOUNDARY, ACCEL_BOUNDARY, lanes=LANES,
+              follow_rate=analysis_by_timestamp.FOLLOW_DISTANCE_RATE, workers=None, force=False,
+              use_cache=True, cache_dir=scene_cache.CACHE_DIR, results_dir=RESULTS_DIR,
+              accuracy=QUANTILE_ACCURACY):
+    params = batch_params(BRAKE_BOUNDARY, ACCEL_BOUNDARY, lanes, follow_rate, accuracy)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    results, keys, pending = {}, {}, []
+    for path in scenes:
+        try:
+            keys[path] = scene_cache.source_key(path, cache_dir)
+        except OSError as error:
+            results[path] = {'status': 'failed', 'summary': None, 'error': str(error)}
+            continue
+        summary = None if force else cached_summary(path, keys[path], params, results_dir)
+        results[path] = {'status': 'cached', 'summary': summary, 'error': None}
+        if summary is None:
+            pending.append(path)
+
+    if pending:
+        with ProcessPoolExecutor(min(workers or os.cpu_count(), len(pending))) as pool:
+            futures = {path: pool.submit(analyze_scene, (path, params, use_cache, cache_dir))
+                       for path in pending}
+            for path, future in futures.items():
+                try:
+                    summary = future.result()
+                except Exception as error:
+                    results[path] = {'status': 'failed', 'summary': None,
+                                     'error': f'{type(error).__name__}: {error}'}
+                    continue
+                save_summary(path, keys[path], params, summary, results_dir)
+                results[path] = {'status': 'ran', 'summary': summary, 'error': None}
+
+    summaries = [scene['summary'] for scene in results.values() if scene['summary'] is not None]
+    pooled = merge_summaries(summaries) if summaries else None
+    return results, pooled
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run both pipelines over many scenes')
+    parser.add_argument('scenes', nargs='+', help='scene files, directories of them or globs')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes, by default one per cpu')
+    parser.add_argument('--brake', type=float, default=BRAKE_BOUNDARY)
+    parser.add_argument('--accel', type=float, default=ACCEL_BOUNDARY)
+    parser.add_argument('--accuracy', type=float, default=QUANTILE_ACCURACY,
+                        help='relative accuracy of the reported percentiles')
+    parser.add_argument('--force', action='store_true', help='ignore cached scene summaries')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse scene files instead of using scene_cache')
+    parser.add_argument('--output', default=None,
+                        help='write the per-scene and pooled summaries to this json file')
+    args = parser.parse_args()
+
+    scenes = find_scenes(args.scenes)
+    if not scenes:
+        parser.error('no scene files found')
+    results, pooled = run_batch(scenes, args.brake, args.accel, workers=args.workers,
+                                force=args.force, use_cache=not args.no_cache,
+                                accuracy=args.accuracy)
+    print_report(results, pooled)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'scenes': {path: dict(scene, summary=summary_to_json(scene['summary'])
+                                      if scene['summary'] is not None else None)
+                           for path, scene in results.items()},
+                'pooled': summary_to_json(pooled) if pooled is not None else None,
+            }, f, indent=1)
+
+    failed = [path for path, scene in results.items() if scene['summary'] is None]
+    if failed:
+        raise SystemExit(f'{len(failed)} of {len(scenes)} scenes failed')
+
+
+if __name__ == '__main__':
+    main()
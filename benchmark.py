@@ -0,0 +1,163 @@
+import argparse
+import os
+import platform
+import subprocess
+
+import numpy as np
+
+import analysis_by_timestamp
+import speed_accel_indiv
+from frame_store import iter_frame_dicts, num_frames
+from instrument import finish_trace, iter_stage, new_trace, stage
+from lanes import build_lane_index
+from transpose import frames_from_trajectories
+from trajectory_store import num_cars
+
+LANE_WIDTH = 12
+
+# first timestamp of synthetic scenes
+EPOCH = 1623877091.0
+
+BRAKE_BOUNDARY, ACCEL_BOUNDARY = -3, 2.25
+
+
+# generates a synthetic highway scene as a trajectory store, along with its lane map. every car is
+# on the road for a random part of the scene, starting at a random point of a road sized so that
+# there are about `density` cars per lane per mile, and drives at its lane's speed with a random
+# walk on top, changing lanes about lane_change_rate times per second
+def synthetic_scene(num_cars=1000, duration=60, frame_rate=25, num_lanes=6, density=40, seed=0,
+                    lane_change_rate=0.02):
+    rng = np.random.default_rng(seed)
+    lanes = {f'L{i+1}': [i*LANE_WIDTH, (i+1)*LANE_WIDTH] for i in range(num_lanes)}
+    frames = max(int(duration*frame_rate), 3)
+
+    lengths = rng.integers(max(frames//5, 3), frames+1, num_cars)
+    offsets = np.append(0, np.cumsum(lengths))
+    first_frame = rng.integers(0, frames - lengths + 1)
+    car = np.repeat(np.arange(num_cars), lengths)
+    step = np.arange(offsets[-1]) - offsets[car]
+
+    # timestamps are the same float at the same frame for every car, so the cars share frames
+    timestamp = EPOCH + (first_frame[car] + step)/frame_rate
+
+    changes = rng.choice([-1, 0, 1], offsets[-1],
+                         p=[lane_change_rate/frame_rate/2, 1 - lane_change_rate/frame_rate,
+                            lane_change_rate/frame_rate/2])
+    lane = np.clip(rng.integers(0, num_lanes, num_cars)[car] + car_cumsum(changes, offsets, car),
+                   0, num_lanes-1)
+    # cars drift over to a new lane over about two seconds, smoothly on both ends
+    window = max(int(frame_rate), 1)
+    y = moving_average(lane*LANE_WIDTH + LANE_WIDTH/2, window, offsets, car)
+    y = moving_average(y, window, offsets, car) + rng.normal(0, 0.0005, offsets[-1])
+
+    # lane speeds from 45 to 75 mph, in ft/s
+    lane_speed = np.linspace(66, 110, num_lanes)
+    speed = (moving_average(moving_average(lane_speed[lane], window, offsets, car), window, offsets,
+                            car) + rng.normal(0, 4, num_cars)[car] +
+             car_cumsum(rng.normal(0, 0.01, offsets[-1]), offsets, car))
+    road_length = 5280*num_cars/(density*num_lanes)
+    x = rng.uniform(0, road_length, num_cars)[car] + car_cumsum(np.maximum(speed, 1)/frame_rate,
+                                                                offsets, car)
+
+    store = {'ids': [f'{i:024x}' for i in range(num_cars)], 'offsets': offsets.astype(np.int64),
+             'timestamp': timestamp, 'x': x, 'y': y}
+    return store, lanes
+
+
+# average of the last `window` values of every sample within its car
+def moving_average(values, window, offsets, car):
+    total = car_cumsum(values, offsets, car)
+    index = np.arange(len(values))
+    first = np.maximum(index - window, offsets[car] - 1)
+    before = np.where(first >= offsets[car], total[np.maximum(first, 0)], 0)
+    return (total - before)/(index - first)
+
+
+# cumulative sum of values restarting at every car
+def car_cumsum(values, offsets, car):
+    total = np.cumsum(values)
+    before = np.append(0, total)[offsets[:-1]]
+    return total - before[car]
+
+
+# runs fn(*args) as a stage of trace and returns its result
+def measure(trace, name, items, fn, *args):
+    with stage(trace, name, items):
+        return fn(*args)
+
+
+# benchmarks the stages of both pipelines on a scene, recording them in trace
+def run_benchmark(store, lanes, trace, follow_rate=analysis_by_timestamp.FOLLOW_DISTANCE_RATE):
+    lane_index = build_lane_index(lanes)
+    samples = len(store['timestamp'])
+
+    # by car
+    measure(trace, 'compute_speed_accel', samples, speed_accel_indiv.compute_speed_accel, store)
+    events = measure(trace, 'compute_accel_events', samples,
+                     speed_accel_indiv.compute_accel_events, store, BRAKE_BOUNDARY, ACCEL_BOUNDARY)
+    measure(trace, 'find_lane_changes', samples, speed_accel_indiv.find_lane_changes, store,
+            lane_index)
+    measure(trace, 'aggregate_trajectories', num_cars(store),
+            speed_accel_indiv.aggregate_trajectories, store, events)
+
+    # by timestamp
+    frames = measure(trace, 'frames_from_trajectories', samples, frames_from_trajectories, store)
+    # the frames are streamed through the frame stages one at a time, each stage adding up its time
+    # over all of them, rather than held as python dicts all at once
+    lane_order = analysis_by_timestamp.new_lane_order()
+    for set in iter_stage(trace, 'iter_frame_dicts', iter_frame_dicts(frames)):
+        items = len(set['position'])
+        measure(trace, 'organize_by_car', items, analysis_by_timestamp.organize_frame_by_car, set,
+                lane_index)
+        measure(trace, 'order_frame_by_x', items, analysis_by_timestamp.order_frame_by_x, set,
+                lane_order)
+        measure(trace, 'frame_follow_distances', items,
+                analysis_by_timestamp.frame_follow_distances, set)
+
+    tracker = analysis_by_timestamp.new_tracker(lane_index, follow_rate=follow_rate)
+    measure(trace, 'track_frame', num_frames(frames), lambda: [
+        analysis_by_timestamp.track_frame(tracker, set) for set in iter_frame_dicts(frames)])
+    measure(trace, 'finish_tracker', num_cars(store), analysis_by_timestamp.finish_tracker,
+            tracker)
+
+
+# describes the code and machine a benchmark ran on
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark both pipelines on a synthetic scene')
+    parser.add_argument('--cars', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument('--frame-rate', type=float, default=25, help='timestamps per second')
+    parser.add_argument('--lanes', type=int, default=6)
+    parser.add_argument('--density', type=float, default=40, help='cars per lane per mile')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memory', action='store_true',
+                        help='trace allocations per stage, which slows down python-heavy stages')
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    params = {'cars': args.cars, 'duration': args.duration, 'frame_rate': args.frame_rate,
+              'lanes': args.lanes, 'density': args.density, 'seed': args.seed}
+    trace = new_trace('benchmark', args.memory)
+    store, lanes = measure(trace, 'synthetic_scene', args.cars, synthetic_scene, args.cars,
+                           args.duration, args.frame_rate, args.lanes, args.density, args.seed)
+    run_benchmark(store, lanes, trace)
+    summary = finish_trace(trace, args.output, params=params, samples=int(len(store['timestamp'])),
+                           environment=environment())
+
+    for record in summary['stages']:
+        print(f"{record['stage']:<26} {record['wall']:>9.3f} s {record['items']:>12} items "
+              f"{record['max_rss']/2**20:>9.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
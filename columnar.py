@@ -0,0 +1,58 @@
+import json
+import os
+import shutil
+
+import numpy as np
+
+META_FILE = 'meta.json'
+
+
+# starts writing a table to the directory at path, one raw binary file per column, with columns
+# given as name: numpy dtype. rows are appended in chunks with write_rows, so a table never has to
+# be held in memory whole, and the table is only complete once close_table writes its meta.json
+def open_table(path, columns):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return {
+        'path': path,
+        'dtypes': {name: np.dtype(dtype) for name, dtype in columns.items()},
+        'files': {name: open(os.path.join(path, f'{name}.bin'), 'wb') for name in columns},
+        'rows': 0,
+    }
+
+
+# appends a chunk of rows given as name: column, with every column of the table the same length
+def write_rows(writer, chunk):
+    lengths = {len(chunk[name]) for name in writer['dtypes']}
+    if len(lengths) != 1:
+        raise ValueError(f'columns of a chunk differ in length: {sorted(lengths)}')
+    for name, dtype in writer['dtypes'].items():
+        writer['files'][name].write(np.ascontiguousarray(chunk[name], dtype=dtype).tobytes())
+    writer['rows'] += lengths.pop()
+
+
+# finishes a table, writing its columns, their dtypes and number of rows, and any other information
+# given as keyword arguments, to meta.json
+def close_table(writer, **info):
+    for f in writer['files'].values():
+        f.close()
+    meta = dict(info, rows=writer['rows'],
+                columns={name: dtype.str for name, dtype in writer['dtypes'].items()})
+    with open(os.path.join(writer['path'], META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+
+# opens a table written by close_table, returning its columns memory-mapped, so reading a table
+# copies nothing until the columns are used, and its meta.json
+def read_table(path):
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+
+    columns = {}
+    for name, dtype in meta['columns'].items():
+        if meta['rows']:
+            columns[name] = np.memmap(os.path.join(path, f'{name}.bin'), dtype=dtype, mode='r',
+                                      shape=(meta['rows'],))
+        else:
+            columns[name] = np.zeros(0, dtype=dtype)
+    return columns, meta
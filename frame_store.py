@@ -0,0 +1,79 @@
+from array import array
+import numpy as np
+
+
+# builds a columnar store out of timestamp frames. x and y positions of the cars in every frame are
+# concatenated into contiguous float64 arrays, and frame i occupies offsets[i]:offsets[i+1]. car ids
+# are kept once in 'ids' and referred to by their index in the int32 'car' column
+def build_frame_store(data):
+    ids, id_index = [], {}
+    lengths = [0]
+    timestamp, x, y, car = array('d'), array('d'), array('d'), array('i')
+
+    for set in data:
+        timestamp.append(set['timestamp'])
+        for pos_x, pos_y in set['position']:
+            x.append(pos_x)
+            y.append(pos_y)
+        car.extend(intern_ids(set['id'], ids, id_index))
+        lengths.append(len(set['id']))
+
+    return {
+        'ids': ids,
+        'offsets': np.cumsum(lengths, dtype=np.int64),
+        'timestamp': np.frombuffer(timestamp, dtype=np.float64),
+        'x': np.frombuffer(x, dtype=np.float64),
+        'y': np.frombuffer(y, dtype=np.float64),
+        'car': np.frombuffer(car, dtype=np.int32),
+    }
+
+
+# returns the index in ids of every car id of a frame's 'id' list, whose entries are plain strings
+# or mongo-style {'$oid': ...} dictionaries. ids is a table of car ids shared by all frames of a
+# scene and id_index maps them back to their index; ids seen for the first time are added to both
+def intern_ids(frame_ids, ids, id_index):
+    codes = []
+    for id in frame_ids:
+        car_id = next(iter(id.values())) if isinstance(id, dict) else id
+        code = id_index.get(car_id)
+        if code is None:
+            code = id_index[car_id] = len(ids)
+            ids.append(car_id)
+        codes.append(code)
+    return codes
+
+
+# number of timestamp frames in the store
+def num_frames(store):
+    return len(store['offsets']) - 1
+
+
+# returns the store of frames first to last (exclusive) of the store, as views of its arrays. the
+# table of car ids is shared, so the cars of the slice keep their index
+def slice_frames(store, first, last):
+    offsets = store['offsets']
+    lo, hi = offsets[first], offsets[last]
+    return {
+        'ids': store['ids'],
+        'offsets': offsets[first:last+1] - lo,
+        'timestamp': store['timestamp'][first:last],
+        'x': store['x'][lo:hi],
+        'y': store['y'][lo:hi],
+        'car': store['car'][lo:hi],
+    }
+
+
+# yields the frames of the store one at a time in the form of the by-timestamp scene file, so they
+# can be fed to analysis_by_timestamp, except that car ids are interned: instead of 'id', 'car'
+# holds the index of every car in 'ids', the table of car ids of the store shared by all frames
+def iter_frame_dicts(store):
+    offsets, ids = store['offsets'], list(store['ids'])
+    timestamp = store['timestamp'].tolist()
+    for i in range(num_frames(store)):
+        lo, hi = offsets[i], offsets[i+1]
+        yield {
+            'timestamp': timestamp[i],
+            'car': store['car'][lo:hi].tolist(),
+            'ids': ids,
+            'position': np.stack([store['x'][lo:hi], store['y'][lo:hi]], axis=1).tolist(),
+        }
@@ -0,0 +1,217 @@
+import numpy as np
+
+import speed_accel_indiv
+from frame_store import num_frames
+from instrument import finish_trace, new_trace, stage
+from lanes import DEFAULT_LANE_INDEX, LANES, build_lane_index, classify_lanes
+from plots import bar_chart, bar_panel
+from running_stats import (QUANTILE_ACCURACY, add_values, histogram_bars, new_accumulator,
+                           percentile_line, stdev)
+from speed_accel_indiv import FEET_PER_MILE, SECONDS_PER_HR
+from stages import evaluate
+from trajectory_store import car_index, store_key, trajectory_heads
+
+# widths of the histogram bins of time headway and time to collision, in seconds
+HEADWAY_BIN_WIDTH = 0.5
+TTC_BIN_WIDTH = 1
+
+# largest time headway and time to collision, in seconds, in their distributions. beyond them the
+# follower is far behind its leader or hardly closing in, and is only counted
+HEADWAY_RANGE = 10
+TTC_RANGE = 30
+
+# a follower is in a critical situation while its time headway or time to collision, in seconds,
+# is below these
+CRITICAL_HEADWAY = 1
+CRITICAL_TTC = 3
+
+
+# returns, for every sample of a frame store, the row of the same car at the same timestamp in a
+# trajectory store, or -1 if it has none. both are sorted by car then timestamp together in one
+# pass, so every frame sample ends up right after its trajectory sample. cars are matched by id,
+# or by index when both stores share their table of car ids, as with
+# transpose.frames_from_trajectories
+def sample_rows(store, frames):
+    car = frames['car']
+    if frames['ids'] is not store['ids']:
+        id_index = {car_id: i for i, car_id in enumerate(store['ids'])}
+        codes = [id_index.get(car_id, -1) for car_id in frames['ids']]
+        car = np.array(codes + [-1], dtype=np.int64)[car]
+    time = np.repeat(frames['timestamp'], np.diff(frames['offsets']))
+
+    rows = len(store['timestamp'])
+    all_car = np.concatenate([car_index(store), car])
+    all_time = np.concatenate([store['timestamp'], time])
+    is_frame = np.arange(len(all_car)) >= rows
+    order = np.lexsort((is_frame, all_time, all_car))
+
+    # the entry before a frame sample in the order, if it's a trajectory sample of the same car and
+    # timestamp
+    previous = np.append(0, order[:-1])
+    found = (is_frame[order] & ~is_frame[previous] & (all_car[previous] == all_car[order]) &
+             (all_time[previous] == all_time[order]))
+    found[:1] = False
+    frame_rows = np.full(len(car), -1, dtype=np.int64)
+    frame_rows[order[found] - rows] = previous[found]
+    return frame_rows
+
+
+# returns every pair of cars next to each other in a lane in every frame of a frame store, as the
+# frame samples of the car behind in x and of the car ahead of it, the same pairs as
+# analysis_by_timestamp.frame_follow_distances. all frames are sorted by frame, lane and x at once
+def frame_pairs(frames, lane_index=DEFAULT_LANE_INDEX):
+    frame = np.repeat(np.arange(num_frames(frames)), np.diff(frames['offsets']))
+    lane = classify_lanes(frames['y'], lane_index)
+    rows = np.flatnonzero(lane >= 0)
+    rows = rows[np.lexsort((frames['x'][rows], lane[rows], frame[rows]))]
+
+    same_lane = (frame[rows[:-1]] == frame[rows[1:]]) & (lane[rows[:-1]] == lane[rows[1:]])
+    return rows[:-1][same_lane], rows[1:][same_lane]
+
+
+# computes time headway and time to collision of every follower-leader pair in every frame of a
+# frame store, joining the speeds of the trajectory store (in mph, from compute_speed_accel) to the
+# pairs of frame_pairs with sample_rows. which car of a pair follows the other is given by the
+# direction both travel in along x, so it works for lanes in either direction. the gap is the
+# distance in x, as for follow distances. time headway is the gap over the follower's speed and
+# time to collision the gap over the speed at which the follower closes it, both in seconds, inf
+# when the follower isn't moving towards the leader or isn't closing in, and nan where either car
+# has no speed (the first sample of its trajectory or no trajectory sample). returns columns frame,
+# time, car and leader (indexes into the frame store's 'ids'), gap (feet), speed and closing speed
+# (feet per second), headway and ttc, in order of frame
+def compute_headways(store, frames, speed, lane_index=DEFAULT_LANE_INDEX):
+    behind, ahead = frame_pairs(frames, lane_index)
+    rows = sample_rows(store, frames)
+    has_speed = rows >= 0
+    has_speed[has_speed] = ~trajectory_heads(store)[rows[has_speed]]
+    speed_x = np.where(has_speed, speed[0][rows]*(FEET_PER_MILE/SECONDS_PER_HR), np.nan)
+
+    # the car behind in x follows the one ahead of it when they travel towards increasing x
+    direction = np.where(speed_x[behind] + speed_x[ahead] < 0, -1.0, 1.0)
+    forward = direction > 0
+    follower = np.where(forward, behind, ahead)
+    leader = np.where(forward, ahead, behind)
+
+    gap = frames['x'][ahead] - frames['x'][behind]
+    follower_speed = direction*speed_x[follower]
+    closing_speed = follower_speed - direction*speed_x[leader]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        headway = np.where(follower_speed > 0, gap/follower_speed, np.inf)
+        ttc = np.where(closing_speed > 0, gap/closing_speed, np.inf)
+    valid = has_speed[behind] & has_speed[ahead]
+    headway[~valid], ttc[~valid] = np.nan, np.nan
+
+    frame = np.repeat(np.arange(num_frames(frames)), np.diff(frames['offsets']))
+    return {
+        'frame': frame[follower],
+        'time': frames['timestamp'][frame[follower]],
+        'car': frames['car'][follower],
+        'leader': frames['car'][leader],
+        'gap': gap,
+        'speed': follower_speed,
+        'closing speed': closing_speed,
+        'headway': headway,
+        'ttc': ttc,
+    }
+
+
+# finds the critical episodes of a column of compute_headways: runs of consecutive frames in which
+# a car follows the same leader with the column below threshold. returns columns car, leader,
+# start and end (timestamps), frames and minimum (the lowest value of the episode), in order of car
+# then start
+def critical_episodes(headways, column, threshold):
+    rows = np.flatnonzero(headways[column] < threshold)
+    car, leader, frame = headways['car'][rows], headways['leader'][rows], headways['frame'][rows]
+    order = np.lexsort((frame, leader, car))
+    rows, car, leader, frame = rows[order], car[order], leader[order], frame[order]
+
+    starts = np.flatnonzero(np.append(True, (car[1:] != car[:-1]) | (leader[1:] != leader[:-1]) |
+                                      (frame[1:] != frame[:-1] + 1))[:len(rows)])
+    ends = np.append(starts[1:], len(rows)) - 1
+    time = headways['time'][rows]
+    values = headways[column][rows]
+    return {
+        'car': car[starts],
+        'leader': leader[starts],
+        'start': time[starts],
+        'end': time[ends],
+        'frames': ends - starts + 1,
+        'minimum': (np.minimum.reduceat(values, starts) if len(starts)
+                    else np.empty(0, dtype=np.float64)),
+    }
+
+
+# summarizes time headway and time to collision over every follower-leader pair with a value in
+# range, counting those beyond it, along with the critical episodes of each below its threshold.
+# quantiles are sketched with the given accuracy
+def summarize_headways(headways, critical_headway=CRITICAL_HEADWAY, critical_ttc=CRITICAL_TTC,
+                       accuracy=QUANTILE_ACCURACY):
+    summary = {}
+    for column, width, limit, threshold in (
+            ('headway', HEADWAY_BIN_WIDTH, HEADWAY_RANGE, critical_headway),
+            ('ttc', TTC_BIN_WIDTH, TTC_RANGE, critical_ttc)):
+        values = headways[column]
+        summary[column] = add_values(new_accumulator(width, accuracy), values[values <= limit])
+        summary[column + ' beyond'] = int(np.count_nonzero(values > limit))
+        summary[column + ' critical'] = critical_episodes(headways, column, threshold)
+    return summary
+
+
+# prints the distributions of time headway and time to collision and their critical episodes
+def print_headway_stats(summary, critical_headway=CRITICAL_HEADWAY, critical_ttc=CRITICAL_TTC):
+    for column, name, limit, threshold in (
+            ('headway', 'time headway', HEADWAY_RANGE, critical_headway),
+            ('ttc', 'time to collision', TTC_RANGE, critical_ttc)):
+        acc, episodes = summary[column], summary[column + ' critical']
+        print(f'across {acc["count"]} follower-leader pairs with a {name} up to {limit} seconds '
+              f'({summary[column + " beyond"]} more beyond it), there was an:\n- average {name} '
+              f'of {acc["mean"]:.2f} seconds\n - maximum: {acc["max"]:.2f}\n - minimum: '
+              f'{acc["min"]:.2f}\n - standard deviation {stdev(acc):.2f}')
+        print(percentile_line(acc))
+        print(f'- {len(episodes["car"])} critical episodes of {name} under {threshold} seconds, '
+              f'by {len(np.unique(episodes["car"]))} cars over {int(episodes["frames"].sum())} '
+              f'timestamps')
+
+        print(f"graphed information of distributions of {name}: ")
+        names, values = histogram_bars(acc)
+        bar_chart(f"{column}_distribution",
+                  [bar_panel(values, f"{name} (seconds)", "frequency",
+                             f"distribution of {name}", tick_labels=names)], font_size=6)
+        print()
+
+
+# runs the functions in headway on the trajectory store of a scene and its frame store, such as
+# one from transpose.frames_from_trajectories. speeds are the kinematics stage of
+# speed_accel_indiv's stage graph, so they are reused if speed_accel_indiv.main already computed
+# them for the same store. that is only the case with a single worker: sharded over several, main
+# computes the kinematics inside the workers, and they are computed again here. returns the
+# summary of summarize_headways
+def main(store, frames, lanes=LANES):
+    config = {
+        'print': 1,
+        'critical_headway': CRITICAL_HEADWAY,
+        'critical_ttc': CRITICAL_TTC,
+        # relative accuracy of the reported percentiles (see running_stats)
+        'quantile_accuracy': QUANTILE_ACCURACY,
+        # time every stage and write a json trace of the run to instrument.TRACE_DIR, optionally
+        # tracing python memory allocations too
+        'instrument': 0,
+        'instrument_memory': 0,
+    }
+
+    trace = new_trace('headway', config['instrument_memory']) if config['instrument'] else None
+    sources = {'load': (store, store_key(store))}
+    kinematics = evaluate(speed_accel_indiv.shared_graph(), 'kinematics', {}, sources, trace)
+    with stage(trace, 'compute_headways', len(frames['car'])):
+        headways = compute_headways(store, frames, kinematics['speed'], build_lane_index(lanes))
+    with stage(trace, 'summarize_headways'):
+        summary = summarize_headways(headways, config['critical_headway'], config['critical_ttc'],
+                                     config['quantile_accuracy'])
+
+    if config['print']:
+        with stage(trace, 'print_headway_stats'):
+            print_headway_stats(summary, config['critical_headway'], config['critical_ttc'])
+
+    if trace is not None:
+        finish_trace(trace)
+    return summary
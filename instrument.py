@@ -0,0 +1,138 @@
+import itertools
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# where finish_trace writes the json trace of every run
+TRACE_DIR = 'traces'
+
+_disabled = nullcontext()
+
+
+# creates the trace of a run, which stage() adds the wall time, cpu time, number of calls, items
+# processed and peak resident set size of each stage to. with trace_memory the peak of memory
+# allocated by python during each stage is traced too, which slows down python-heavy stages
+def new_trace(run, trace_memory=False):
+    if trace_memory:
+        tracemalloc.start()
+    return {
+        'run': run,
+        'started': time.time(),
+        'wall': time.perf_counter(),
+        'cpu': time.process_time(),
+        'trace_memory': trace_memory,
+        'stages': {},
+        'peaks': [],
+    }
+
+
+# times a stage of a run in a with statement. a stage entered several times, such as a step done
+# for every timestamp, adds up over all of them. with no trace it does nothing, so pipelines can
+# call it unconditionally
+def stage(trace, name, items=0):
+    if trace is None:
+        return _disabled
+    return _stage(trace, name, items)
+
+
+@contextmanager
+def _stage(trace, name, items):
+    record = trace['stages'].setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0, 'items': 0,
+                                               'max_rss': 0})
+    peaks = trace['peaks']
+    if trace['trace_memory']:
+        # the peak is reset for the stage, so the stages it is nested in keep their own peak so far
+        if peaks:
+            peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+        peaks.append(0)
+        tracemalloc.reset_peak()
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall'] += time.perf_counter() - wall
+        record['cpu'] += time.process_time() - cpu
+        record['calls'] += 1
+        record['items'] += items
+        record['max_rss'] = max_rss()
+        if trace['trace_memory']:
+            peak = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+            record['peak_allocated'] = max(record.get('peak_allocated', 0), peak)
+            if peaks:
+                peaks[-1] = max(peaks[-1], peak)
+
+
+# yields the items of an iterable, timing the work of producing them, such as reading and parsing a
+# streamed scene file, as a stage
+def iter_stage(trace, name, iterable):
+    if trace is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with stage(trace, name, 1):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                trace['stages'][name]['items'] -= 1
+                return
+        yield item
+
+
+# peak resident set size of the process in bytes
+def max_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss*1024
+
+
+# creates a new trace file named base.json, or base-2.json, base-3.json and so on when runs that
+# started in the same second already took the name, and returns it open along with its path
+def create_trace_file(base):
+    for n in itertools.count(1):
+        path = f'{base}.json' if n == 1 else f'{base}-{n}.json'
+        try:
+            return open(path, 'x'), path
+        except FileExistsError:
+            continue
+
+
+# ends a run: writes its trace as json to path (by default TRACE_DIR/<run>-<start time>.json) along
+# with any other information about the run given as keyword arguments, prints a one-line summary
+# and returns the trace as written
+def finish_trace(trace, path=None, **info):
+    summary = {
+        **info,
+        'run': trace['run'],
+        'started': trace['started'],
+        'wall': time.perf_counter() - trace['wall'],
+        'cpu': time.process_time() - trace['cpu'],
+        'max_rss': max_rss(),
+        'stages': [{'stage': name, **record} for name, record in trace['stages'].items()],
+    }
+    if trace['trace_memory']:
+        summary['peak_allocated'] = max([tracemalloc.get_traced_memory()[1]] +
+                                        [record['peak_allocated'] for record in summary['stages']])
+        tracemalloc.stop()
+
+    if path is None:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        f, path = create_trace_file(
+            os.path.join(TRACE_DIR, f"{trace['run']}-{time.strftime('%Y%m%d-%H%M%S')}"))
+    else:
+        f = open(path, 'w')
+    with f:
+        json.dump(summary, f, indent=1)
+
+    line = (f"{summary['run']}: {summary['wall']:.2f} s wall, {summary['cpu']:.2f} s cpu, "
+            f"{summary['max_rss']/2**20:.0f} MiB peak rss")
+    if summary['stages']:
+        slowest = max(summary['stages'], key=lambda record: record['wall'])
+        line += (f", slowest stage {slowest['stage']} {slowest['wall']:.2f} s "
+                 f"({100*slowest['wall']/max(summary['wall'], 1e-9):.0f}%)")
+    print(f'{line}, trace in {path}')
+    return summary
@@ -0,0 +1,41 @@
+import numpy as np
+
+
+# marks the events of `left` that overlap an event of the same car in `right`, once every event of
+# right is widened by `window` seconds on both sides. both are tables with columns car, start and
+# end, where a point event has the same start and end. the join is one sort-merge over all cars:
+# right is sorted by car and start, and each left event looks up the right events starting before
+# it ends and checks whether the furthest reaching of them ends after it starts
+def overlaps(left, right, window=0):
+    if not len(left['car']) or not len(right['car']):
+        return np.zeros(len(left['car']), dtype=bool)
+
+    # car and time in one sortable float, every car in its own span of time
+    origin = min(left['start'].min(), right['start'].min()) - window
+    span = max(left['end'].max(), right['end'].max()) + window - origin + 1
+    right_car = np.asarray(right['car'], dtype=np.int64)
+    order = np.lexsort((right['start'], right_car))
+    right_car = right_car[order]
+    key = right_car*span + (right['start'][order] - origin)
+    reach = np.maximum.accumulate(right_car*span + (right['end'][order] - origin))
+
+    left_car = np.asarray(left['car'], dtype=np.int64)
+    row = np.searchsorted(key, left_car*span + (left['end'] + window - origin), side='right') - 1
+    found = row >= 0
+    row = np.maximum(row, 0)
+    return (found & (right_car[row] == left_car) &
+            (reach[row] - left_car*span >= left['start'] - window - origin))
+
+
+# counts, for every pair of named event tables in sets, the events of the first that overlap an
+# event of the second within window seconds, per car. returns {a: {'#': events per car, b: events
+# of a overlapping b per car}}, one row per car so counts of consecutive groups of cars merge by
+# concatenation
+def count_co_occurrences(sets, num_cars, window=0):
+    counts = {}
+    for a, left in sets.items():
+        counts[a] = {'#': np.bincount(left['car'], minlength=num_cars)}
+        for b, right in sets.items():
+            counts[a][b] = np.bincount(left['car'], weights=overlaps(left, right, window),
+                                       minlength=num_cars).astype(np.int64)
+    return counts
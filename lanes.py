@@ -0,0 +1,33 @@
+import numpy as np
+
+# lanes of the highway as name: [lower y, upper y], where a position is in a lane if
+# lower < y <= upper
+LANES = {'E1': [0, 12], 'E2': [12, 24], 'E3': [24, 36], 'E4': [36, 48], 'E5': [48, 60],
+         'E6': [60, 72], 'W1': [72, 84], 'W2': [84, 96], 'W3': [96, 108], 'W4': [108, 120],
+         'W5': [120, 132], 'W6': [132, 144]}
+
+
+# builds a lookup index over a lane map. lanes are sorted by their lower bound so a position can be
+# placed with a binary search, and are identified by their code, the position of the lane in the map
+def build_lane_index(lanes=LANES):
+    names = list(lanes.keys())
+    order = sorted(range(len(names)), key=lambda code: lanes[names[code]][0])
+    return {
+        'names': names,
+        'code': np.array(order, dtype=np.int64),
+        'lower': np.array([lanes[names[code]][0] for code in order], dtype=np.float64),
+        'upper': np.array([lanes[names[code]][1] for code in order], dtype=np.float64),
+    }
+
+
+# returns the lane code of every y-coordinate in y_pos, or -1 where the position is in no lane
+def classify_lanes(y_pos, lane_index):
+    y_pos = np.asarray(y_pos, dtype=np.float64)
+
+    # the only lane a position can be in is the last one starting below it
+    candidate = np.maximum(np.searchsorted(lane_index['lower'], y_pos, side='left') - 1, 0)
+    in_lane = (lane_index['lower'][candidate] < y_pos) & (y_pos <= lane_index['upper'][candidate])
+    return np.where(in_lane, lane_index['code'][candidate], -1)
+
+
+DEFAULT_LANE_INDEX = build_lane_index(LANES)
@@ -0,0 +1,164 @@
+from array import array
+import numpy as np
+
+# columns written by save_leader_index, everything else is rebuilt on load
+SAVED_COLUMNS = ['ids', 'car', 'leader', 'start', 'end', 'offsets', 'by start', 'sorted start',
+                 'key', 'origin', 'span', 'max duration', 'follow car', 'follow leader',
+                 'follow distance', 'follow time', 'follow offsets']
+
+
+# builds a query index over the leader intervals and follow distances of analysis_by_timestamp, in
+# the form car_id: {'leader': [(leader, start, end)],
+# 'follow distance': [(leader, distance, time)]}. car ids are interned to their position in 'ids'
+# and a missing leader is -1. intervals are sorted by car then start, with car i occupying
+# offsets[i]:offsets[i+1], and are also ordered by start across all cars for time range queries.
+# follow distances are laid out the same way, and are taken from follow, the follow distance table
+# of the tracker, when it is given
+def build_leader_index(by_car_by_timestamp, follow=None):
+    ids, id_index = [], {}
+
+    def code(car_id):
+        if car_id is None:
+            return -1
+        if car_id not in id_index:
+            id_index[car_id] = len(ids)
+            ids.append(car_id)
+        return id_index[car_id]
+
+    car, leader, start, end = array('i'), array('i'), array('d'), array('d')
+    f_car, f_leader, f_distance, f_time = array('i'), array('i'), array('d'), array('d')
+    for car_id, items in by_car_by_timestamp.items():
+        c = code(car_id)
+        for lead, begin, finish in items['leader']:
+            car.append(c)
+            leader.append(code(lead))
+            start.append(begin)
+            end.append(finish)
+        for lead, distance, time in (items.get('follow distance') or ()) if follow is None else ():
+            f_car.append(c)
+            f_leader.append(code(lead))
+            f_distance.append(distance)
+            f_time.append(time)
+
+    if follow is not None:
+        # a missing leader (-1) maps to the trailing -1
+        codes = np.array([code(car_id) for car_id in follow['ids']] + [-1], dtype=np.int32)
+        f_car, f_leader = codes[follow['car']], codes[follow['leader']]
+        f_distance, f_time = follow['distance'], follow['time']
+
+    index = {'ids': ids}
+    index.update(sorted_columns(len(ids), 'offsets', {
+        'car': (car, np.int32), 'start': (start, np.float64), 'leader': (leader, np.int32),
+        'end': (end, np.float64)}))
+    index.update(sorted_columns(len(ids), 'follow offsets', {
+        'follow car': (f_car, np.int32), 'follow time': (f_time, np.float64),
+        'follow leader': (f_leader, np.int32), 'follow distance': (f_distance, np.float64)}))
+
+    start, end = index['start'], index['end']
+    index['by start'] = np.argsort(start, kind='stable')
+    index['sorted start'] = start[index['by start']]
+    index['max duration'] = np.float64((end - start).max() if len(start) else 0)
+
+    # intervals keyed on car and start in one sortable float, so batches of point queries are a
+    # single binary search
+    index['origin'] = np.float64(start.min() if len(start) else 0)
+    index['span'] = np.float64((end.max() - index['origin'] if len(end) else 0) + 1)
+    index['key'] = index['car']*index['span'] + (start - index['origin'])
+
+    index['id index'] = id_index
+    return index
+
+
+# turns arrays of rows into numpy columns sorted by the first column (the car) then the second (the
+# time), along with the offsets of every car's rows
+def sorted_columns(num_cars, offsets, columns):
+    columns = {name: np.asarray(column, dtype=dtype) for name, (column, dtype) in columns.items()}
+    car, time = list(columns.values())[:2]
+    order = np.lexsort((time, car))
+
+    result = {name: column[order] for name, column in columns.items()}
+    result[offsets] = np.searchsorted(car[order], np.arange(num_cars+1)).astype(np.int64)
+    return result
+
+
+# writes the index to a .npz file, to be shipped with the scene's results
+def save_leader_index(path, index):
+    columns = {name: np.asarray(index[name]) for name in SAVED_COLUMNS}
+    columns['ids'] = np.array([str(car_id) for car_id in index['ids']], dtype=str)
+    np.savez(path, **columns)
+
+
+# reads an index written by save_leader_index
+def load_leader_index(path):
+    with np.load(path) as f:
+        index = {name: f[name] for name in SAVED_COLUMNS}
+    index['ids'] = index['ids'].tolist()
+    index['id index'] = {car_id: i for i, car_id in enumerate(index['ids'])}
+    return index
+
+
+# returns the leader of a car at a time, or None if it had none or was not tracked then
+def leader_at(index, car_id, time):
+    return leaders_at(index, [car_id], [time])[0]
+
+
+# returns the leader of every car in car_ids at the matching time in times, or None where it had
+# none or was not tracked then
+def leaders_at(index, car_ids, times):
+    if not len(index['key']):
+        return [None]*len(car_ids)
+    id_index = index['id index']
+    car = np.array([id_index.get(car_id, -1) for car_id in car_ids], dtype=np.int64)
+    times = np.asarray(times, dtype=np.float64)
+
+    row = np.searchsorted(index['key'], car*index['span'] + (times - index['origin']),
+                          side='right') - 1
+    row = np.maximum(row, 0)
+    found = ((car >= 0) & (index['car'][row] == car) & (index['start'][row] <= times) &
+             (times <= index['end'][row]))
+    leader = np.where(found, index['leader'][row], -1)
+    return [index['ids'][code] if code >= 0 else None for code in leader.tolist()]
+
+
+# returns every car-following interval overlapping the time range t1 to t2 as (car, leader, start,
+# end). only intervals starting up to the longest interval's duration before t1 can reach into the
+# range, so just those are looked at
+def following_between(index, t1, t2):
+    lo = np.searchsorted(index['sorted start'], t1 - index['max duration'], side='left')
+    hi = np.searchsorted(index['sorted start'], t2, side='right')
+    rows = index['by start'][lo:hi]
+    rows = rows[(index['end'][rows] >= t1) & (index['leader'][rows] >= 0)]
+
+    ids = index['ids']
+    return [(ids[car], ids[leader], start, end) for car, leader, start, end in
+            zip(index['car'][rows].tolist(), index['leader'][rows].tolist(),
+                index['start'][rows].tolist(), index['end'][rows].tolist())]
+
+
+# returns the intervals during which car_id followed leader_id as (start, end)
+def pair_intervals(index, car_id, leader_id):
+    lo, hi = car_rows(index, car_id, 'offsets')
+    leader = -1 if leader_id is None else index['id index'].get(leader_id, -2)
+    rows = lo + np.flatnonzero(index['leader'][lo:hi] == leader)
+    return list(zip(index['start'][rows].tolist(), index['end'][rows].tolist()))
+
+
+# returns the follow distances of a car sampled between t1 and t2 as (leader, distance, time)
+def follow_distances(index, car_id, t1, t2):
+    lo, hi = car_rows(index, car_id, 'follow offsets')
+    time = index['follow time']
+    first = lo + np.searchsorted(time[lo:hi], t1, side='left')
+    last = lo + np.searchsorted(time[lo:hi], t2, side='right')
+
+    ids = index['ids']
+    return [(ids[leader] if leader >= 0 else None, distance, t) for leader, distance, t in
+            zip(index['follow leader'][first:last].tolist(),
+                index['follow distance'][first:last].tolist(), time[first:last].tolist())]
+
+
+# returns the range of rows of a car in the columns laid out by the given offsets
+def car_rows(index, car_id, offsets):
+    car = index['id index'].get(car_id)
+    if car is None:
+        return 0, 0
+    return int(index[offsets][car]), int(index[offsets][car+1])
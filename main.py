@@ -1,29 +1,68 @@
-import json
+import plots
+import scene_cache
+import scene_index
+import scene_io
+from trajectory_store import build_trajectory_store, store_key
+from transpose import frames_from_trajectories
 
+# the by-timestamp view of the scene is built from this file in memory, so no transformed copy of
+# it is needed
 FILE_BY_CAR = "groundtruth_scene_1_130__cajoles.json"
-FILE_BY_TIMESTAMP = "groundtruth_scene_1_130__cajoles_transformed.json"
+
+# keep a binary copy of each scene in scene_cache.CACHE_DIR so later runs skip json parsing
+USE_CACHE = 1
+
+# analyze only part of the scene: a time range (first, last timestamp, either None for no bound),
+# lane names and car ids, each None for all of them. the parts of the scene holding them are found
+# with the scene file's sidecar index (see scene_index), which is built on the first run
+TIME_RANGE = None
+LANE_NAMES = None
+CAR_IDS = None
+
+# processes used to analyze trajectories and timestamps; results are the same for any number
+WORKERS = 1
+
+# 'show' opens each graph in a window, 'save' writes them all to plots/ at the end of the run and
+# 'off' only writes the data behind them
+PLOT_MODE = 'show'
 
 import speed_accel_indiv
 import analysis_by_timestamp
+import headway
 
 def main():
-    with open(FILE_BY_CAR) as f:
-        data_by_car = json.load(f)
-    with open(FILE_BY_TIMESTAMP) as f:
-        data_by_timestamp = json.load(f)
+    plots.configure(mode=PLOT_MODE)
+
+    subset = TIME_RANGE is not None or LANE_NAMES is not None or CAR_IDS is not None
+    data_by_car = None
+    if USE_CACHE:
+        data_by_car = scene_cache.load_trajectory_store(FILE_BY_CAR)
+    elif not subset:
+        # the file is streamed one trajectory at a time rather than loaded whole
+        data_by_car = build_trajectory_store(scene_io.iter_trajectories(FILE_BY_CAR))
+    if subset:
+        # only the parts of the cached store, or of the file without a cache, holding the selected
+        # samples are read, and both pipelines only see those samples
+        data_by_car = scene_index.load_trajectories(FILE_BY_CAR, TIME_RANGE, LANE_NAMES, CAR_IDS,
+                                                    store=data_by_car)
+    data_by_timestamp = frames_from_trajectories(data_by_car)
 
     # analyze speed and acceleration information for individual trajectories
     # per bound
     print("-3 to 2.25")
-    speed_accel_indiv.main(data_by_car, -3, 2.25)
-    #
-    # print("-2.5 to 2")
-    # speed_accel_indiv.main(data_by_car, -2.5, 2)
-    #
-    # print("-1.5 to 1")
-    # speed_accel_indiv.main(data_by_car, -1.5, 1)
-
-    # analyze interactions between cars
-    analysis_by_timestamp.main(data_by_timestamp)
+    speed_accel_indiv.main(data_by_car, -3, 2.25, workers=WORKERS)
+
+    # compare other bounds, reusing the speed, acceleration and lane changes of every trajectory
+    # table = speed_accel_indiv.sweep_boundaries(data_by_car, [(-3, 2.25), (-2.5, 2), (-1.5, 1)])
+    # speed_accel_indiv.print_sweep(table)
+
+    # analyze interactions between cars. the timestamps are identified by the store they come from
+    analysis_by_timestamp.main(data_by_timestamp, source_key=store_key(data_by_car),
+                               workers=WORKERS)
+
+    # time headway and time to collision of every follower and its leader at every timestamp
+    headway.main(data_by_car, data_by_timestamp)
+
+    plots.export_plots()
 
 main()
\ No newline at end of file
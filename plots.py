@@ -0,0 +1,113 @@
+import json
+import os
+from multiprocessing import Process
+
+# how figures are produced. 'show' opens each figure in a window as soon as it is made, 'save'
+# renders all figures to files in output_dir in one batch when export_plots is called (in a
+# separate process if background is set), and 'off' draws nothing. in 'save' and 'off' mode the
+# data behind every figure is written to output_dir as json
+config = {
+    'mode': 'show',
+    'output_dir': 'plots',
+    'formats': ['png'],
+    'background': 0,
+}
+
+_pending = []
+_names = {}
+
+
+# updates the plotting config, e.g. configure(mode='save', formats=['png', 'svg'])
+def configure(**options):
+    unknown = set(options) - set(config)
+    if unknown:
+        raise ValueError(f'unknown plot options: {sorted(unknown)}')
+    config.update(options)
+
+
+# one bar chart of a figure. bars are placed at x, or at 0, 1, 2... and labelled with tick_labels
+def bar_panel(height, xlabel, ylabel, title, x=None, tick_labels=None, width=0.8):
+    return {
+        'x': list(range(len(height))) if x is None else list(x),
+        'height': list(height),
+        'width': width,
+        'tick_labels': None if tick_labels is None else [str(label) for label in tick_labels],
+        'xlabel': xlabel,
+        'ylabel': ylabel,
+        'title': title,
+    }
+
+
+# adds a figure made of bar chart panels side by side, which is shown, queued for export or only
+# has its data written depending on the mode
+def bar_chart(name, panels, font_size=None):
+    figure = {'name': unique_name(name), 'panels': panels, 'font size': font_size}
+    if config['mode'] == 'show':
+        render(figure, show=True)
+        return
+
+    write_data(figure, config['output_dir'])
+    if config['mode'] == 'save':
+        _pending.append(figure)
+
+
+# renders every figure queued in 'save' mode to files. returns the background process when
+# rendering happens in one, so callers can wait for it
+def export_plots():
+    figures = _pending[:]
+    _pending.clear()
+    if not figures:
+        return None
+
+    args = (figures, config['output_dir'], config['formats'])
+    if config['background']:
+        process = Process(target=render_all, args=args)
+        process.start()
+        return process
+    render_all(*args)
+    return None
+
+
+# renders figures to files in every format without a display
+def render_all(figures, output_dir, formats):
+    import matplotlib
+    matplotlib.use('Agg')
+    for figure in figures:
+        render(figure, output_dir=output_dir, formats=formats)
+
+
+# draws a figure and either shows it or saves it to output_dir. matplotlib is only imported here, so
+# runs that never draw a figure never load it
+def render(figure, show=False, output_dir=None, formats=()):
+    import matplotlib.pyplot as plt
+
+    rc = {'font.size': figure['font size']} if figure['font size'] else {}
+    with plt.rc_context(rc):
+        fig, axis = plt.subplots(nrows=1, ncols=len(figure['panels']), squeeze=False)
+        for ax, panel in zip(axis[0], figure['panels']):
+            ax.bar(panel['x'], panel['height'], width=panel['width'],
+                   tick_label=panel['tick_labels'])
+            ax.set_ylabel(panel['ylabel'])
+            ax.set_xlabel(panel['xlabel'])
+            ax.set_title(panel['title'])
+
+        if show:
+            plt.show()
+            return
+        os.makedirs(output_dir, exist_ok=True)
+        for fmt in formats:
+            fig.savefig(os.path.join(output_dir, f"{figure['name']}.{fmt}"))
+        plt.close(fig)
+
+
+# writes the data behind a figure to output_dir/<name>.json
+def write_data(figure, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, f"{figure['name']}.json"), 'w') as f:
+        json.dump(figure, f)
+
+
+# makes figure names unique within a run, so a pipeline run twice does not overwrite its own files
+def unique_name(name):
+    _names[name] = _names.get(name, 0) + 1
+    return name if _names[name] == 1 else f'{name}_{_names[name]}'
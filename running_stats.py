@@ -0,0 +1,199 @@
+import math
+import numpy as np
+
+# relative accuracy of the quantiles of an accumulator: a quantile is within this fraction of the
+# value of that rank in the stream
+QUANTILE_ACCURACY = 0.01
+
+# values closer to 0 than this are counted as 0 by the quantile sketch
+SKETCH_MIN_VALUE = 1e-6
+
+# percentiles given by percentile_line
+REPORT_PERCENTILES = (5, 15, 50, 85, 95)
+
+
+# creates an empty accumulator of count, mean, m2 (sum of squared differences from the mean), min
+# and max of a stream of values, with a histogram of the values in bins of the given width.
+# histogram[k] counts the values that round to k*width. quantiles of the stream are kept in a
+# sketch of bins growing geometrically away from 0 (see sketch_counts), so every quantile is within
+# accuracy of the true one, in memory bounded by the range of the values rather than their number.
+# sketches, like histograms, merge by adding up the counts of their bins
+def new_accumulator(width=1, accuracy=QUANTILE_ACCURACY):
+    return {'count': 0, 'mean': 0.0, 'm2': 0.0, 'min': math.inf, 'max': -math.inf,
+            'width': width, 'histogram': {}, 'accuracy': accuracy, 'sketch': {}}
+
+
+# adds a batch of values to the accumulator
+def add_values(acc, values):
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return acc
+    mean = values.mean()
+    combine(acc, len(values), mean, ((values - mean)**2).sum(), values.min(), values.max())
+    add_to_histogram(acc['histogram'], *histogram_counts(values, acc['width']))
+    add_to_histogram(acc['sketch'], *sketch_counts(values, acc['accuracy']))
+    return acc
+
+
+# merges another accumulator with the same bin width and accuracy into acc
+def merge_accumulators(acc, other):
+    if other['width'] != acc['width']:
+        raise ValueError('only accumulators of the same bin width can be merged')
+    if other['accuracy'] != acc['accuracy']:
+        raise ValueError('only accumulators of the same accuracy can be merged')
+    combine(acc, other['count'], other['mean'], other['m2'], other['min'], other['max'])
+    add_to_histogram(acc['histogram'], list(other['histogram'].keys()),
+                     list(other['histogram'].values()))
+    add_to_histogram(acc['sketch'], list(other['sketch'].keys()), list(other['sketch'].values()))
+    return acc
+
+
+# returns the accumulator as plain json-serializable values, with the histogram and the sketch as
+# lists of [bin, count] pairs since json keys can only be strings
+def accumulator_to_dict(acc):
+    return dict(acc, histogram=[[k, count] for k, count in sorted(acc['histogram'].items())],
+                sketch=[[k, count] for k, count in sorted(acc['sketch'].items())])
+
+
+# rebuilds an accumulator from accumulator_to_dict
+def accumulator_from_dict(values):
+    return dict(values, histogram={int(k): int(count) for k, count in values['histogram']},
+                sketch={int(k): int(count) for k, count in values['sketch']})
+
+
+# per-group summaries of values split into consecutive groups of the given sizes, one row per group
+# in columns count, mean, m2, min and max, plus the histogram and the quantile sketch of all values
+# as parallel bins and bin counts columns. the table records the bin width and the accuracy it was
+# summarized with. tables of consecutive groups merge by concatenating their columns
+def group_summaries(values, sizes, width=1, accuracy=QUANTILE_ACCURACY):
+    values = np.asarray(values, dtype=np.float64)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    starts = np.cumsum(sizes) - sizes
+    nonempty = sizes > 0
+
+    mean = np.zeros(len(sizes))
+    m2 = np.zeros(len(sizes))
+    low = np.full(len(sizes), math.inf)
+    high = np.full(len(sizes), -math.inf)
+    if len(values):
+        starts, group_sizes = starts[nonempty], sizes[nonempty]
+        mean[nonempty] = np.add.reduceat(values, starts)/group_sizes
+        m2[nonempty] = np.add.reduceat((values - np.repeat(mean[nonempty], group_sizes))**2, starts)
+        low[nonempty] = np.minimum.reduceat(values, starts)
+        high[nonempty] = np.maximum.reduceat(values, starts)
+
+    bins, bin_counts = histogram_counts(values, width)
+    sketch_bins, sketch_bin_counts = sketch_counts(values, accuracy)
+    return {'count': sizes, 'mean': mean, 'm2': m2, 'min': low, 'max': high,
+            'bins': bins, 'bin counts': bin_counts, 'sketch bins': sketch_bins,
+            'sketch counts': sketch_bin_counts, 'width': width, 'accuracy': accuracy}
+
+
+# folds a table of group summaries into an accumulator, group by group in order, so the result only
+# depends on the groups and not on how the table was split and merged. the accumulator must have
+# the bin width and accuracy the table was summarized with
+def add_group_summaries(acc, groups):
+    if groups['width'] != acc['width']:
+        raise ValueError('group summaries must have the bin width of the accumulator')
+    if groups['accuracy'] != acc['accuracy']:
+        raise ValueError('group summaries must have the accuracy of the accumulator')
+    for count, mean, m2, low, high in zip(groups['count'].tolist(), groups['mean'].tolist(),
+                                          groups['m2'].tolist(), groups['min'].tolist(),
+                                          groups['max'].tolist()):
+        combine(acc, count, mean, m2, low, high)
+    add_to_histogram(acc['histogram'], groups['bins'].tolist(), groups['bin counts'].tolist())
+    add_to_histogram(acc['sketch'], groups['sketch bins'].tolist(),
+                     groups['sketch counts'].tolist())
+    return acc
+
+
+# standard deviation of the values in the accumulator
+def stdev(acc):
+    return math.sqrt(acc['m2']/(acc['count']-1)) if acc['count'] > 1 else float('nan')
+
+
+# returns the q-quantiles of the values in the accumulator for every q in qs (0 to 1), from its
+# sketch, or nan for an empty accumulator. the value of rank q*(count-1) is looked up among the
+# sketch bins in order of value
+def quantiles(acc, qs):
+    if not acc['count']:
+        return [float('nan')]*len(qs)
+    keys = sorted(acc['sketch'])
+    cumulative = np.cumsum([acc['sketch'][k] for k in keys])
+    at = np.searchsorted(cumulative, np.asarray(qs, dtype=np.float64)*(cumulative[-1] - 1),
+                         side='right')
+    return [min(max(sketch_value(keys[i], acc['accuracy']), acc['min']), acc['max'])
+            for i in np.minimum(at, len(keys) - 1).tolist()]
+
+
+# formats the percentiles of the accumulator as a line of the reports
+def percentile_line(acc, percentiles=REPORT_PERCENTILES):
+    values = quantiles(acc, [p/100 for p in percentiles])
+    return ' - percentiles: ' + ', '.join(f'p{p} {value:.2f}'
+                                          for p, value in zip(percentiles, values))
+
+
+# returns the histogram as bin labels and counts for every bin between the lowest and highest,
+# including the bins no value fell in so the bins are equally spaced
+def histogram_bars(acc):
+    histogram = acc['histogram']
+    if not histogram:
+        return [], []
+    bins = range(min(histogram), max(histogram)+1)
+    return [k*acc['width'] for k in bins], [histogram.get(k, 0) for k in bins]
+
+
+# combines the count, mean, m2, min and max of a group of values into the accumulator using the
+# pairwise update of Chan et al.
+def combine(acc, count, mean, m2, low, high):
+    if not count:
+        return
+    total = acc['count'] + count
+    delta = mean - acc['mean']
+    acc['mean'] += delta*count/total
+    acc['m2'] += m2 + delta**2*acc['count']*count/total
+    acc['count'] = total
+    acc['min'] = min(acc['min'], low)
+    acc['max'] = max(acc['max'], high)
+
+
+# counts values per histogram bin, returning the bins used and their counts
+def histogram_counts(values, width):
+    bins, counts = np.unique(np.round(values/width).astype(np.int64), return_counts=True)
+    return bins, counts
+
+
+# adds counts to the bins of a histogram
+def add_to_histogram(histogram, bins, counts):
+    for k, count in zip(bins, counts):
+        histogram[int(k)] = histogram.get(int(k), 0) + int(count)
+
+
+# counts values per quantile sketch bin, returning the bins used and their counts. bin i > 0 holds
+# the values above gamma**(i+offset-1) up to gamma**(i+offset), where gamma is
+# (1+accuracy)/(1-accuracy) and offset comes from sketch_scale, so its value sketch_value is within
+# accuracy of all of them. negative values go in the negative bins mirroring them, and values
+# near 0 in bin 0
+def sketch_counts(values, accuracy):
+    log_gamma, offset = sketch_scale(accuracy)
+    magnitude = np.abs(values)
+    small = magnitude < SKETCH_MIN_VALUE
+    index = np.ceil(np.log(np.where(small, 1, magnitude))/log_gamma) - offset
+    bins, counts = np.unique(np.where(small, 0, np.sign(values)*index).astype(np.int64),
+                             return_counts=True)
+    return bins, counts
+
+
+# returns the value of a quantile sketch bin
+def sketch_value(k, accuracy):
+    if k == 0:
+        return 0.0
+    log_gamma, offset = sketch_scale(accuracy)
+    return math.copysign(2*math.exp((abs(k) + offset)*log_gamma)/(math.exp(log_gamma) + 1), k)
+
+
+# log of the growth factor gamma of the quantile sketch bins of the given accuracy, and the offset
+# of the bin indexes, so values from SKETCH_MIN_VALUE up are in bins above 0
+def sketch_scale(accuracy):
+    log_gamma = math.log((1 + accuracy)/(1 - accuracy))
+    return log_gamma, math.floor(math.log(SKETCH_MIN_VALUE)/log_gamma) - 1
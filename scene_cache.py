@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+import scene_io
+from frame_store import build_frame_store
+from trajectory_store import build_trajectory_store
+
+CACHE_DIR = '.scene_cache'
+MAX_CACHE_BYTES = 8 * 1024**3
+CACHE_VERSION = 2
+HASH_CHUNK_SIZE = 1 << 20
+
+SOURCES_FILE = 'sources.json'
+META_FILE = 'meta.json'
+IDS_FILE = 'ids.json'
+
+# how each kind of scene file is turned into a columnar store
+BUILDERS = {
+    'by_car': lambda path: build_trajectory_store(scene_io.iter_trajectories(path)),
+    'by_timestamp': lambda path: build_frame_store(scene_io.iter_frames(path)),
+}
+
+
+# loads the trajectory store of a by-car scene file, converting it on first load and opening the
+# cached columns memory-mapped afterwards
+def load_trajectory_store(path, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    return load_store(path, 'by_car', cache_dir, max_bytes)
+
+
+# loads the frame store of a by-timestamp scene file, converting it on first load and opening the
+# cached columns memory-mapped afterwards
+def load_frame_store(path, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    return load_store(path, 'by_timestamp', cache_dir, max_bytes)
+
+
+# returns the columnar store of a scene file of the given kind from the cache. the cache entry is
+# keyed on the size, modification time and content hash of the file, is rebuilt whenever any of
+# them changes, and the least recently used entries are evicted once the cache is over max_bytes
+def load_store(path, kind, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    os.makedirs(cache_dir, exist_ok=True)
+    key = source_key(path, cache_dir)
+    entry = os.path.join(cache_dir, f"{kind}-{key['sha256']}")
+
+    if not entry_is_valid(entry, kind, key):
+        remove_stale_entries(cache_dir, kind, key)
+        write_entry(entry, kind, key, BUILDERS[kind](path))
+        evict(cache_dir, max_bytes, keep=entry)
+
+    # marks the entry as recently used for eviction
+    os.utime(os.path.join(entry, META_FILE))
+    return open_entry(entry)
+
+
+# returns the size, modification time and sha256 of a file. the hash of a file whose size and
+# modification time are unchanged since it was last hashed is reused rather than recomputed
+def source_key(path, cache_dir=CACHE_DIR):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    sources_path = os.path.join(cache_dir, SOURCES_FILE)
+    sources = read_json(sources_path, {})
+
+    known = sources.get(path)
+    if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    key = {'source': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+           'sha256': digest.hexdigest()}
+    sources[path] = key
+    write_json(sources_path, sources)
+    return key
+
+
+# checks that a cache entry exists, is complete and was built from the current version of the file
+def entry_is_valid(entry, kind, key):
+    meta = read_json(os.path.join(entry, META_FILE), None)
+    return (meta is not None and meta['version'] == CACHE_VERSION and meta['kind'] == kind
+            and meta['sha256'] == key['sha256'] and meta['size'] == key['size'])
+
+
+# writes every column of a store to its own .npy file, except the car ids, which are written to
+# ids.json so they come back as they were, strings or integers. the entry is written to a temporary
+# directory first and renamed into place, so a half-written entry is never picked up
+def write_entry(entry, kind, key, store):
+    tmp = f'{entry}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    columns = []
+    for name, column in store.items():
+        if name == 'ids':
+            write_json(os.path.join(tmp, IDS_FILE), [
+                car_id.item() if isinstance(car_id, np.generic) else car_id for car_id in column])
+            continue
+        np.save(os.path.join(tmp, f'{name}.npy'), np.asarray(column))
+        columns.append(name)
+
+    write_json(os.path.join(tmp, META_FILE), dict(key, kind=kind, version=CACHE_VERSION,
+                                                   columns=columns, created=time.time()))
+    shutil.rmtree(entry, ignore_errors=True)
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # another process put the same entry in place first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+# opens the columns of a cache entry without reading them into memory. the car ids are read as a
+# list
+def open_entry(entry):
+    meta = read_json(os.path.join(entry, META_FILE), None)
+    store = {'ids': read_json(os.path.join(entry, IDS_FILE), None)}
+    store.update({name: np.load(os.path.join(entry, f'{name}.npy'), mmap_mode='r')
+                  for name in meta['columns']})
+    return store
+
+
+# removes entries of the same kind built from an older version of the same file
+def remove_stale_entries(cache_dir, kind, key):
+    for entry in list_entries(cache_dir):
+        meta = read_json(os.path.join(entry, META_FILE), {})
+        if meta.get('source') == key['source'] and meta.get('kind') == kind:
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+# deletes the least recently used entries until the cache fits in max_bytes, never deleting keep
+def evict(cache_dir, max_bytes=MAX_CACHE_BYTES, keep=None):
+    entries = []
+    for entry in list_entries(cache_dir):
+        meta_path = os.path.join(entry, META_FILE)
+        last_used = os.path.getmtime(meta_path) if os.path.exists(meta_path) else 0
+        entries.append((last_used, entry, entry_size(entry)))
+
+    total = sum(size for last_used, entry, size in entries)
+    for last_used, entry, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(entry) == os.path.abspath(keep or ''):
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+# lists the entry directories of the cache
+def list_entries(cache_dir):
+    if not os.path.isdir(cache_dir):
+        return []
+    return [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+            if os.path.isdir(os.path.join(cache_dir, name))]
+
+
+# total size in bytes of the files of a cache entry
+def entry_size(entry):
+    return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+
+# reads a json file, returning default if it is missing or unreadable
+def read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+# writes a json file in one step so readers never see it half written
+def write_json(path, value):
+    tmp = f'{path}.tmp-{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp, path)
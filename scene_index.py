@@ -0,0 +1,135 @@
+import json
+import math
+import os
+
+import numpy as np
+
+import scene_cache
+import scene_io
+from lanes import LANES, build_lane_index, classify_lanes
+from trajectory_store import (build_trajectory_store, car_index, concat_stores, filter_samples,
+                              get_car_id, slice_store)
+
+# the sidecar index of a scene file is kept next to it, as <scene file><INDEX_SUFFIX>
+INDEX_SUFFIX = '.index'
+INDEX_VERSION = 1
+
+# consecutive trajectories of the scene file per chunk of the index
+CHUNK_CARS = 64
+
+# fewest samples a car keeps in a loaded subset. cars with fewer have no acceleration and, with a
+# single sample, no time in the scene, so they are left out
+MIN_SAMPLES = 3
+
+
+# builds the sidecar index of a by-car scene file. the trajectories of the file are split into
+# chunks of chunk_cars consecutive ones, and every chunk records where it is in the file ('offset'
+# and 'length' in bytes), which cars it holds ('first car', 'cars' and their 'ids'), the time
+# range its samples cover ('start' and 'end') and the lanes of `lanes` they were in
+def build_scene_index(path, lanes=LANES, chunk_cars=CHUNK_CARS):
+    lane_index = build_lane_index(lanes)
+    chunks = []
+    for car, (data_set, start, end) in enumerate(scene_io.iter_json_array(path, offsets=True)):
+        if car % chunk_cars == 0:
+            chunks.append({'offset': start, 'length': 0, 'first car': car, 'cars': 0,
+                           'ids': [], 'start': math.inf, 'end': -math.inf, 'lanes': set()})
+        chunk = chunks[-1]
+        chunk['length'] = end - chunk['offset']
+        chunk['cars'] += 1
+        chunk['ids'].append(get_car_id(data_set, car))
+        if len(data_set['timestamp']):
+            chunk['start'] = min(chunk['start'], min(data_set['timestamp']))
+            chunk['end'] = max(chunk['end'], max(data_set['timestamp']))
+        lane = classify_lanes(data_set['y_position'], lane_index)
+        chunk['lanes'].update(lane[lane >= 0].tolist())
+
+    for chunk in chunks:
+        chunk['lanes'] = [lane_index['names'][code] for code in sorted(chunk['lanes'])]
+    return {'version': INDEX_VERSION, 'lanes': lanes, 'chunk cars': chunk_cars, 'chunks': chunks}
+
+
+# returns the sidecar index of a scene file, building it on first use and again whenever the file,
+# the lanes or the chunk size change
+def load_scene_index(path, lanes=LANES, chunk_cars=CHUNK_CARS, cache_dir=scene_cache.CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    key = scene_cache.source_key(path, cache_dir)
+    index_path = path + INDEX_SUFFIX
+    index = scene_cache.read_json(index_path, None)
+    if (index is None or index['version'] != INDEX_VERSION or index['sha256'] != key['sha256']
+            or index['lanes'] != json.loads(json.dumps(lanes))
+            or index['chunk cars'] != chunk_cars):
+        index = dict(build_scene_index(path, lanes, chunk_cars), sha256=key['sha256'])
+        scene_cache.write_json(index_path, index)
+    return index
+
+
+# returns the chunks of an index that may hold samples in the time range (first, last timestamp,
+# either None for no bound), in any of the lanes named in lane_names and of any of the cars in
+# car_ids. None means no restriction
+def select_chunks(index, time_range=None, lane_names=None, car_ids=None):
+    first, last = time_range or (None, None)
+    lane_names = None if lane_names is None else set(lane_names)
+    car_ids = None if car_ids is None else set(car_ids)
+
+    selected = []
+    for chunk in index['chunks']:
+        if (first is not None and chunk['end'] < first) or (last is not None and
+                                                            chunk['start'] > last):
+            continue
+        if lane_names is not None and lane_names.isdisjoint(chunk['lanes']):
+            continue
+        if car_ids is not None and car_ids.isdisjoint(chunk['ids']):
+            continue
+        selected.append(chunk)
+    return selected
+
+
+# loads the samples of a by-car scene file in the time range, lanes and cars given as in
+# select_chunks, as a trajectory store. only the chunks of the file that may hold them are read,
+# adjacent chunks in one go: from the file, or, given the store of the whole scene (such as one
+# memory-mapped by scene_cache), from its columns. samples outside the lanes are left out, so a
+# car that leaves them has a gap in its trajectory, and cars with fewer than MIN_SAMPLES samples
+# are left out
+def load_trajectories(path, time_range=None, lane_names=None, car_ids=None, store=None,
+                      lanes=LANES, cache_dir=scene_cache.CACHE_DIR):
+    index = load_scene_index(path, lanes, cache_dir=cache_dir)
+    parts = []
+    for first, last in chunk_runs(select_chunks(index, time_range, lane_names, car_ids)):
+        if store is not None:
+            parts.append(slice_store(store, first['first car'], last['first car'] + last['cars']))
+        else:
+            parts.append(build_trajectory_store(scene_io.iter_json_array(
+                path, start=first['offset'], end=last['offset'] + last['length'])))
+    subset = concat_stores(parts)
+    return filter_samples(subset, sample_filter(subset, time_range, lane_names, car_ids, lanes),
+                          MIN_SAMPLES)
+
+
+# groups chunks into runs of chunks following each other in the file, as (first, last) chunk
+def chunk_runs(chunks):
+    runs = []
+    for chunk in chunks:
+        if runs and runs[-1][1]['first car'] + runs[-1][1]['cars'] == chunk['first car']:
+            runs[-1] = (runs[-1][0], chunk)
+        else:
+            runs.append((chunk, chunk))
+    return runs
+
+
+# marks the samples of a store in the time range, lanes and cars given as in select_chunks
+def sample_filter(store, time_range=None, lane_names=None, car_ids=None, lanes=LANES):
+    keep = np.ones(len(store['timestamp']), dtype=bool)
+    first, last = time_range or (None, None)
+    if first is not None:
+        keep &= store['timestamp'] >= first
+    if last is not None:
+        keep &= store['timestamp'] <= last
+    if lane_names is not None:
+        lane_index = build_lane_index(lanes)
+        codes = [code for code, name in enumerate(lane_index['names']) if name in set(lane_names)]
+        keep &= np.isin(classify_lanes(store['y'], lane_index), codes)
+    if car_ids is not None:
+        wanted = set(car_ids)
+        kept = np.array([car_id in wanted for car_id in store['ids']], dtype=bool)
+        keep &= kept[car_index(store)]
+    return keep
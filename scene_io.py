@@ -0,0 +1,97 @@
+import codecs
+import json
+
+CHUNK_SIZE = 1 << 20  # bytes read from the file at a time
+WHITESPACE = ' \t\r\n'
+DELIMITERS = WHITESPACE + ',]'
+
+
+# yields the elements of a file holding one top-level json array (a list of car trajectories or of
+# timestamp frames) one at a time. the file is read in chunks, so only the element being decoded is
+# held in memory rather than the whole scene. with offsets, every element comes with the byte
+# offsets in the file where it starts and ends, and given such a start offset (and optionally an
+# end offset) only the elements from there on (up to there) are read
+def iter_json_array(path, chunk_size=CHUNK_SIZE, start=None, end=None, offsets=False):
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    track = offsets or end is not None
+    with open(path, 'rb') as f:
+        if start is not None:
+            f.seek(start)
+        buf, pos, eof, started = '', 0, False, start is not None
+        # byte offset in the file of buf[mark], moved forward as the buffer is consumed
+        mark, mark_byte = 0, start or 0
+        while True:
+            # skips whitespace and the commas between elements
+            while pos < len(buf) and (buf[pos] in WHITESPACE or (started and buf[pos] == ',')):
+                pos += 1
+
+            if pos == len(buf):
+                if eof:
+                    if start is not None:
+                        return
+                    raise ValueError(f'{path}: json array is not closed')
+                if track:
+                    mark, mark_byte = 0, mark_byte + _byte_length(buf, mark, pos)
+                buf, pos, eof = _read_more(f, utf8, buf, pos, chunk_size)
+                continue
+
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError(f'{path}: expected a json array')
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+
+            if track:
+                mark, mark_byte = pos, mark_byte + _byte_length(buf, mark, pos)
+                if end is not None and mark_byte >= end:
+                    return
+            try:
+                item, stop = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                if track:
+                    mark = 0
+                buf, pos, eof = _read_more(f, utf8, buf, pos, chunk_size)
+                continue
+
+            # a number cut off by the end of the buffer may continue in the next chunk
+            if not eof and (stop == len(buf) or buf[stop] not in DELIMITERS):
+                if track:
+                    mark = 0
+                buf, pos, eof = _read_more(f, utf8, buf, pos, chunk_size)
+                continue
+
+            if offsets:
+                yield item, mark_byte, mark_byte + _byte_length(buf, pos, stop)
+            else:
+                yield item
+            pos = stop
+
+
+# drops the consumed part of the buffer and appends the next chunk of the file. chunks grow with
+# the buffer so an element larger than chunk_size is decoded in a few attempts
+def _read_more(f, utf8, buf, pos, chunk_size):
+    buf = buf[pos:]
+    chunk = f.read(max(chunk_size, len(buf)))
+    return buf + utf8.decode(chunk, final=not chunk), 0, not chunk
+
+
+# number of bytes buf[first:last] takes up in the file
+def _byte_length(buf, first, last):
+    text = buf[first:last]
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
+
+# yields the car trajectories of a by-car scene file one at a time
+def iter_trajectories(path, chunk_size=CHUNK_SIZE):
+    return iter_json_array(path, chunk_size)
+
+
+# yields the timestamp frames of a by-timestamp scene file one at a time
+def iter_frames(path, chunk_size=CHUNK_SIZE):
+    return iter_json_array(path, chunk_size)
@@ -1,74 +1,83 @@
-import math
-import matplotlib.pyplot as plt
-import statistics as st
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from instrument import finish_trace, new_trace, stage
+from interval_join import count_co_occurrences, overlaps
+from lanes import DEFAULT_LANE_INDEX, LANES, build_lane_index, classify_lanes
+from plots import bar_chart, bar_panel
+from running_stats import (QUANTILE_ACCURACY, add_group_summaries, group_summaries, histogram_bars,
+                           new_accumulator, percentile_line, stdev)
+from stages import add_stage, evaluate, new_graph
+from trajectory_store import (as_trajectory_store, car_index, num_cars, shard_bounds, slice_store,
+                              store_key, trajectory_heads)
 
 FEET_PER_MILE = 5280
 SECONDS_PER_HR = 3600
 
+# widths of the histogram bins of speed (mph) and acceleration (ft/s^2)
+SPEED_BIN_WIDTH = 5
+ACCEL_BIN_WIDTH = 1
 
-# computes the speed and acceleration of vehicles at every time point
-def compute_speed_accel(data):
-    l = []
-    for data_set in data:
-        timestamp = data_set['timestamp']
-        l.append(timestamp)
-        y_pos = data_set['y_position']
-        x_pos = data_set['x_position']
-        speed = [(0,0,0)]
-        accel = [(0,0,0), (0,0,0)]
+# events of a trajectory counted as co-occurring when they are at most this many seconds apart
+CONDITIONAL_WINDOW = 1
 
-        for i in range(1, len(timestamp)):
-            x1, x2, y1, y2 = x_pos[i-1], x_pos[i], y_pos[i-1], y_pos[i]
+# the events A and B of the conditional probabilities P(B|A) and P(A|B), named as in event_sets
+CONDITIONAL_EVENTS = ('lane change', 'x accel')
 
-            # in miles
-            y_dist = (y2-y1)/FEET_PER_MILE
-            x_dist = (x2-x1)/FEET_PER_MILE
-            delta_dist = math.sqrt((x_dist)**2+(y_dist)**2)
+# shards of trajectories per worker process, so uneven shards even out across workers
+SHARDS_PER_WORKER = 4
 
-            delta_time = (timestamp[i]-timestamp[i-1])  # in seconds
+# store shared by the tasks a worker process runs, sent once per worker rather than per task
+_worker_store = None
 
+# stage graph of main, kept between calls so unchanged stages are not recomputed
+_graph = None
 
-            y_speed_cur = y_dist/delta_time*SECONDS_PER_HR
-            x_speed_cur = x_dist/delta_time*SECONDS_PER_HR
-            cur_speed = delta_dist/delta_time*SECONDS_PER_HR  # mph
 
-            speed.append((x_speed_cur, y_speed_cur, cur_speed))  # converts to mph
+# computes the speed and acceleration of vehicles at every time point for all trajectories in the
+# store at once. speed and accel are stored as (3, n) arrays whose rows are the x, y and total
+# components, with the first sample of each trajectory having no speed and the first two having no
+# acceleration
+def compute_speed_accel(store):
+    timestamp, x_pos, y_pos = store['timestamp'], store['x'], store['y']
+    first = trajectory_heads(store)
+    first_two = trajectory_heads(store, 2)
 
-            if i == 1:
-                continue
+    # in miles
+    y_dist = np.diff(y_pos, prepend=0)/FEET_PER_MILE
+    x_dist = np.diff(x_pos, prepend=0)/FEET_PER_MILE
+    delta_time = np.diff(timestamp, prepend=0)  # in seconds
+    y_dist[first], x_dist[first], delta_time[first] = 0, 0, 1
+    delta_dist = np.sqrt((x_dist)**2+(y_dist)**2)
 
-            delta_speed = cur_speed - speed[i-1][2]
-            delta_speed_y = y_speed_cur - speed[i-1][1]
-            delta_speed_x = x_speed_cur - speed[i-1][0]
+    speed = np.empty((3, len(timestamp)))
+    speed[0] = x_dist/delta_time*SECONDS_PER_HR
+    speed[1] = y_dist/delta_time*SECONDS_PER_HR
+    speed[2] = delta_dist/delta_time*SECONDS_PER_HR  # mph
 
-            cur_accel = delta_speed*(FEET_PER_MILE/SECONDS_PER_HR)/delta_time  # accel per sec: fpsps
-            y_accel_cur = delta_speed_y*(FEET_PER_MILE/SECONDS_PER_HR)/delta_time
-            x_accel_cur = delta_speed_x*(FEET_PER_MILE/SECONDS_PER_HR)/delta_time
+    # accel per sec: fpsps
+    accel = np.diff(speed, prepend=0)*(FEET_PER_MILE/SECONDS_PER_HR)/delta_time
+    accel[:, first_two] = 0
 
-            accel.append((x_accel_cur, y_accel_cur, cur_accel))
-        data_set['speed'], data_set['accel'] = speed, accel
+    store['speed'], store['accel'] = speed, accel
 
 
 # prints acceleration and speed data of car trajectories
-def print_speed_accel(data):
-    speed = []
-    accel = []
-    ttl = 0
-    for set in data:
-        ttl+=1
-
-        # just concatenate the lists
-        for i in range(1, len(set['speed'])):
-            speed.append(set['speed'][i][2])
-            if i == 1: continue
-            accel.append(set['accel'][i][2])
-
-    print(f"across {ttl} trajectories, there was:\n- an average speed of {st.mean(speed):.2f}"
-          f" miles per hour\n - maximum: {max(speed):.2f}\n - minimum: {min(speed):.2f}\n - "
-          f"standard deviation: {st.stdev(speed):.2f}")
-    print(f"- an average acceleration of {st.mean(accel):.2f} feet per second squared\n"
-          f" - maximum: {max(accel):.2f}\n - minimum: {min(accel):.2f}\n - standard deviation: "
-          f"{st.stdev(accel):.2f}")
+def print_speed_accel(results):
+    ttl = len(results['lanes per car'])
+    speed = add_group_summaries(new_accumulator(SPEED_BIN_WIDTH, results['speed']['accuracy']),
+                                results['speed'])
+    accel = add_group_summaries(new_accumulator(ACCEL_BIN_WIDTH, results['accel']['accuracy']),
+                                results['accel'])
+
+    print(f"across {ttl} trajectories, there was:\n- an average speed of {speed['mean']:.2f}"
+          f" miles per hour\n - maximum: {speed['max']:.2f}\n - minimum: {speed['min']:.2f}\n - "
+          f"standard deviation: {stdev(speed):.2f}")
+    print(percentile_line(speed))
+    print(f"- an average acceleration of {accel['mean']:.2f} feet per second squared\n"
+          f" - maximum: {accel['max']:.2f}\n - minimum: {accel['min']:.2f}\n - standard deviation: "
+          f"{stdev(accel):.2f}")
+    print(percentile_line(accel))
 
     print("graphed information of distributions of speed and acceleration: ")
     graph_speed_accel(speed, accel)
@@ -76,214 +85,182 @@ def print_speed_accel(data):
     print()
 
 
-# graphs speed and acceleration information of car trajectories
+# graphs speed and acceleration information of car trajectories from their histograms
 def graph_speed_accel(speed, accel):
-    figure, axis = plt.subplots(nrows=1, ncols=2)
-    axis[0].hist(speed)
-    axis[0].set_ylabel("# of trajectories")
-    axis[0].set_xlabel("speed (mph)")
-    axis[0].set_title("distribution of speeds")
-
-    axis[1].hist(accel)
-    axis[1].set_ylabel("# of trajectories")
-    axis[1].set_xlabel("acceleration (f/s^2)")
-    axis[1].set_title("distribution of accelerations")
-
-    plt.show()
-
-
-# this function takes in a variable and returns dictionary keys of # and % accel and brake events
-# makes it easier to add/access specific x, y, or overall acceleration information.
-def convert_variable_to_names(variable):
-    if variable == 'x':
-        idx = 0
-        num_accel_name = '# x_accel'
-        num_brake_name = '# x_brake'
-        percent_accel_name = '% x_accel'
-        percent_brake_name = '% x_brake'
-
-    elif variable == 'y':
-        idx = 1
-        num_accel_name = '# y_accel'
-        num_brake_name = '# y_brake'
-        percent_accel_name = '% y_accel'
-        percent_brake_name = '% y_brake'
-    elif variable == 'ttl':
-        idx = 2
-        num_accel_name = '# accel'
-        num_brake_name = '# brake'
-        percent_accel_name = '% accel'
-        percent_brake_name = '% brake'
-    return idx, num_accel_name, num_brake_name, percent_accel_name, percent_brake_name
-
-
-# computes the number of acceleration and brake events per trajectory and adds it in data set
-# in the form of (avg acceleration of event, start time, end time)
-def compute_accel_events(data, variable, BRAKE_BOUNDARY, ACCEL_BOUNDARY):
-    idx_accel, num_accel_name, num_brake_name, percent_accel_name, percent_brake_name \
-        = convert_variable_to_names(variable)
-
-    for data_set in data:
-        accel = data_set['accel']
-        data_set[num_accel_name], data_set[num_brake_name] = [], []
-        b, a, event = False, False, False
-        start_time, start_idx, running_sum, running_count = 0, 0, 0, 0
-        index = 0
-        while index < len(accel):
-            pt = accel[index][idx_accel]
-
-            # event ends or prog ends...
-            if event and (((a and pt < ACCEL_BOUNDARY) or (b and pt > BRAKE_BOUNDARY)) or index == len(accel)-1):
-                end_idx = index
-
-                # checks if new event is beginning. if it jumps from -3 to 2.25 in one time stamp
-                if (a and pt <= BRAKE_BOUNDARY) or (b and pt >= ACCEL_BOUNDARY):
-                    # event ends, but new event immediately begins, so we set index back for next
-                    # iteration to start at current index and begin event.
-                    index -= 1
-
-                # start time, end time, avg acceleration
-                cur = (running_sum/running_count, start_time, data_set['timestamp'][end_idx])
-                if running_sum < 0:
-                    data_set[num_brake_name].append(cur)
-                    b = False
-                else:
-                    data_set[num_accel_name].append(cur)
-                    a = False
-                event = False
-                running_sum, running_count = 0,0
-
-            # event begins
-            elif not event and pt >= ACCEL_BOUNDARY or pt <= BRAKE_BOUNDARY:
-                event = True
-                start_idx = index
-                start_time = data_set['timestamp'][start_idx]
-                running_sum += pt
-                running_count += 1
-                if pt >= ACCEL_BOUNDARY:
-                    a = True
-                else:
-                    b = True
-
-            # event is occurring
-            elif event and index!=len(accel)-1:
-                # make sure it doesn't jump from -3 to 2.25 in one time stamp
-                running_sum += pt
-                running_count += 1
-
-            index += 1
-
-
-# computes percentage of total trajectory spent in acceleration and brake events
-def compute_accel_percentage(data, variable):
-    idx, num_accel_name, num_brake_name, percent_accel_name, percent_brake_name \
-        = convert_variable_to_names(variable)
-    for data_set in data:
-        total_time = data_set['timestamp'][-1]-data_set['timestamp'][0]
-        time_accel, time_brake = 0, 0
-        if data_set[num_accel_name]:
-            for itm in data_set[num_accel_name]:
-                time_accel += itm[2]-itm[1]
-        if data_set[num_brake_name]:
-            for itm in data_set[num_brake_name]:
-                time_brake += itm[2] - itm[1]
-        data_set[percent_accel_name] = time_accel / total_time
-        data_set[percent_brake_name] = time_brake / total_time
+    names, values = histogram_bars(speed)
+    speed_panel = bar_panel(values, "speed (mph)", "# of trajectories", "distribution of speeds",
+                            x=names, width=speed['width'])
+
+    names, values = histogram_bars(accel)
+    accel_panel = bar_panel(values, "acceleration (f/s^2)", "# of trajectories",
+                            "distribution of accelerations", x=names, width=accel['width'])
+
+    bar_chart("speed_accel_distribution", [speed_panel, accel_panel])
+
+
+# rows of the speed and accel arrays holding x, y and overall (total) components
+AXES = {'x': 0, 'y': 1, 'ttl': 2}
+
+
+# finds acceleration and brake events of every trajectory for all axes in one pass. each sample is
+# labelled accel (>= ACCEL_BOUNDARY), brake (<= BRAKE_BOUNDARY) or neither, and an event is a run of
+# equally labelled samples within a trajectory, so a jump straight from braking to accelerating
+# ends one event and begins the next on the same sample. returns, per axis, tables of acceleration
+# and brake events with columns car, mean (avg acceleration of event), start and end time, plus
+# the fraction of each trajectory spent in acceleration and brake events
+def compute_accel_events(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY):
+    accel, timestamp, offsets = store['accel'], store['timestamp'], store['offsets']
+    n = len(timestamp)
+
+    labels = np.zeros(accel.shape, dtype=np.int8)
+    labels[accel >= ACCEL_BOUNDARY] = 1
+    labels[(accel <= BRAKE_BOUNDARY) & (labels == 0)] = -1
+    labels, values = labels.ravel(), accel.ravel()
+
+    # run-length encode the labels of all axes back to back, breaking runs at each new trajectory
+    new_run = np.tile(trajectory_heads(store), len(AXES))
+    new_run[1:] |= labels[1:] != labels[:-1]
+    starts = np.flatnonzero(new_run)
+    ends = np.append(starts[1:], labels.size)
+    in_event = labels[starts] != 0
+    starts, ends = starts[in_event], ends[in_event]
+
+    # an event ends on the first sample past it, or on the last sample of the trajectory, which is
+    # then not part of the event's average. events beginning on the last sample never end
+    car = car_index(store)[starts % n]
+    last = starts - starts % n + offsets[car+1] - 1
+    ends = np.minimum(ends, last)
+    ended = starts < last
+    starts, ends, car = starts[ended], ends[ended], car[ended]
+
+    if len(starts):
+        sums = np.add.reduceat(values, np.stack([starts, ends], axis=1).ravel())[::2]
+    else:
+        sums = np.zeros(0)
+    means = sums/(ends-starts)
+
+    # while a brake event goes on its start time is moved up to each sample still under
+    # BRAKE_BOUNDARY, so brake events are timed from the last sample before they end
+    start_time = np.where(labels[starts] > 0, timestamp[starts % n], timestamp[(ends-1) % n])
+    end_time = timestamp[ends % n]
+
+    total_time = timestamp[offsets[1:]-1] - timestamp[offsets[:-1]]
+
+    events = {}
+    for var, idx_accel in AXES.items():
+        on_axis = starts // n == idx_accel
+        events[var] = {}
+        for name, is_kind in ('accel', sums >= 0), ('brake', sums < 0):
+            keep = on_axis & is_kind
+            events[var][name] = {
+                'car': car[keep],
+                'mean': means[keep],
+                'start': start_time[keep],
+                'end': end_time[keep],
+            }
+            time_in_event = np.bincount(car[keep], weights=end_time[keep] - start_time[keep],
+                                        minlength=len(total_time))
+            events[var]['% ' + name] = time_in_event / total_time
+    return events
+
+
+# counts the acceleration and brake events of every trajectory for each variable, with the sum of
+# their average accelerations and the fraction of time spent in them, one row per car
+def count_accel_events(store, events):
+    counts = {}
+    for var in AXES:
+        counts[var] = {}
+        for name in 'accel', 'brake':
+            table = events[var][name]
+            counts[var]['# ' + name] = np.bincount(table['car'], minlength=num_cars(store))
+            counts[var]['sum ' + name] = np.bincount(table['car'], weights=table['mean'],
+                                                     minlength=num_cars(store))
+            counts[var]['% ' + name] = events[var]['% ' + name]
+    return counts
+
+
+# summarizes the acceleration events of one variable: number of events, their average
+# acceleration and the average fraction of time trajectories spent in them
+def summarize_accel_events(results, variable):
+    counts = results[variable]
+    num_accel_events = counts['# accel'].sum()
+    num_brake_events = counts['# brake'].sum()
+    sum_accel = counts['sum accel'].sum()
+    sum_brake = counts['sum brake'].sum()
+    return {
+        '# accel': int(num_accel_events),
+        '# brake': int(num_brake_events),
+        'avg accel': sum_accel/num_accel_events if num_accel_events>0 else 0,
+        'avg brake': sum_brake/num_brake_events if num_brake_events>0 else 0,
+        '% accel': counts['% accel'].mean(),
+        '% brake': counts['% brake'].mean(),
+    }
 
 
 # prints statistics regarding acceleration events
-def print_accel_event_stats(data, variable):
-    idx, num_accel_name, num_brake_name, percent_accel_name, percent_brake_name \
-        = convert_variable_to_names(variable)
+def print_accel_event_stats(results, variable):
     var_to_print = variable if variable!='ttl' else 'overall'
-    num_accel_events = 0
-    num_brake_events = 0
-    percent_in_accel = [0,0]
-    percent_in_brake = [0,0]
-    sum_accel = 0
-    sum_brake = 0
-    for data_set in data:
-        num_accel_events += len(data_set[num_accel_name])
-        num_brake_events += len(data_set[num_brake_name])
-
-        for i in data_set[num_accel_name]:
-            sum_accel += i[0]
-
-        for i in data_set[num_brake_name]:
-            sum_brake += i[0]
-
-        if data_set[num_accel_name] != 0:
-            percent_in_accel[0] += data_set[percent_accel_name]
-            percent_in_accel[1] += 1
-        if data_set[num_brake_name] != 0:
-            percent_in_brake[0] += data_set[percent_brake_name]
-            percent_in_brake[1] += 1
+    summary = summarize_accel_events(results, variable)
 
     print(f"total {var_to_print} events:",
-          num_brake_events+num_accel_events)
+          summary['# brake']+summary['# accel'])
     print(f"total {var_to_print} acceleration events:",
-          num_accel_events)
+          summary['# accel'])
     print(f"total {var_to_print} brake events:",
-          num_brake_events)
+          summary['# brake'])
 
     print(f"average acceleration of {var_to_print} acceleration events: "
-          f"{sum_accel/num_accel_events if num_accel_events>0 else 0:.2f} ft/s/s")
+          f"{summary['avg accel']:.2f} ft/s/s")
     print(f"average braking of {var_to_print} brake events: "
-          f"{sum_brake/num_brake_events if num_brake_events>0 else 0:.2f} ft/s/s")
+          f"{summary['avg brake']:.2f} ft/s/s")
 
     print(f"average percent of time spent in {var_to_print} acceleration events of cars that had "
-          f"acceleration events: {100*percent_in_accel[0]/percent_in_accel[1]:.2f}%")
+          f"acceleration events: {100*summary['% accel']:.2f}%")
     print(f"average percent of time spent in {var_to_print} brake events of cars that had brake "
-          f"events: {100*percent_in_brake[0]/percent_in_brake[1]:.2f}%")
+          f"events: {100*summary['% brake']:.2f}%")
 
     print()
 
 
-# finds lane changes and puts it in 'lane_changes' key in form [lane_name, start time in lane, end time in lane]
-def find_lane_changes(data):
-    lanes = {'E1': [0, 12], 'E2': [12, 24], 'E3': [24, 36], 'E4': [36, 48], 'E5': [48, 60],
-             'E6': [60, 72], 'W1': [72, 84], 'W2': [84, 96], 'W3': [96, 108], 'W4': [108, 120],
-             'W5': [120, 132], 'W6': [132, 144]}
-
-    for data_set in data:
-        y_pos = data_set['y_position']
-        data_set['lane_changes'] = []
-        prev, cur = None, None
-        start_time, stop_time = data_set['timestamp'][0], None
-        for i, y in enumerate(y_pos):
-
-            # finds which lane the car is in
-            for lane, rnge in lanes.items():
-                if rnge[0] < y <= rnge[1]:
-                    cur = lane
-                    if not prev:
-                        prev = cur
-                    break
-
-            # lane change occurs
-            if prev != cur:
-                stop_time = data_set['timestamp'][i]
-                data_set['lane_changes'].append([prev, start_time, stop_time])
-                start_time = stop_time
-                prev = cur
-
-        # add the last lane in
-        if not data_set['lane_changes'] or data_set['lane_changes'][-1][0] != cur:
-            data_set['lane_changes'].append([cur, start_time, data_set['timestamp'][-1]])
+# finds lane changes of all trajectories and puts them in the 'lane_changes' key as a table of time
+# spent in each lane, with columns car, lane (code in lane_index), start time and end time in lane.
+# positions outside of every lane count as the lane the car was last seen in
+def find_lane_changes(store, lane_index=DEFAULT_LANE_INDEX):
+    offsets, timestamp = store['offsets'], store['timestamp']
+    n = len(timestamp)
+    heads = trajectory_heads(store)
+    lane = classify_lanes(store['y'], lane_index)
+
+    # carry each car's last known lane forward over unknown positions, starting every car from its
+    # first known lane
+    known = np.where(lane >= 0, np.arange(n), -1)
+    first_known = np.minimum.reduceat(np.where(lane >= 0, np.arange(n), n), offsets[:-1])
+    car_starts = offsets[:-1]
+    known[car_starts] = np.where(first_known < offsets[1:], first_known, car_starts)
+    lane = lane[np.maximum.accumulate(known)]
+
+    # lane change occurs
+    seg_starts = np.flatnonzero(heads | np.append(False, lane[1:] != lane[:-1]))
+    seg_ends = np.append(seg_starts[1:], n)
+    last_in_car = np.append(heads, True)[seg_ends]
+    seg_ends[last_in_car] -= 1
+
+    store['lane_changes'] = {
+        'car': car_index(store)[seg_starts],
+        'lane': lane[seg_starts],
+        'start': timestamp[seg_starts],
+        'end': timestamp[seg_ends],
+    }
 
 
 # prints data regarding lane change information for car trajectories
-def print_lane_changes(data):
-    ttl, ttl_lc, num_changes = 0,0,0
-    lanes = {'E1': 0, 'E2': 0, 'E3': 0, 'E4': 0, 'E5': 0, 'E6': 0, 'W1': 0, 'W2': 0,
-                      'W3': 0, 'W4': 0, 'W5': 0, 'W6': 0}
-    for set in data:
-        ttl += 1
-        if len(set['lane_changes']) > 1:
-            ttl_lc += 1
-            num_changes += len(set['lane_changes']) - 1
-        for chng in set['lane_changes']:
-            lanes[chng[0]] += 1
+def print_lane_changes(results, lane_index=DEFAULT_LANE_INDEX):
+    lanes_per_car = results['lanes per car']
+    ttl = len(lanes_per_car)
+    ttl_lc = np.count_nonzero(lanes_per_car > 1)
+    num_changes = lanes_per_car.sum() - ttl
+    lane = results['lane']
+    lanes = np.bincount(lane[lane >= 0], minlength=len(lane_index['names']))
 
     print(f'there were {ttl_lc} trajectories with lane changes, with an average of '
           f'{num_changes/ttl_lc:.2f} lane changes. ')
@@ -291,95 +268,352 @@ def print_lane_changes(data):
           f'{(num_changes+ttl)/ttl:.2f}. ')
     print()
 
-    names = list(lanes.keys())
-    values = list(lanes.values())
+    names = lane_index['names']
+    values = lanes.tolist()
 
-    plt.bar(range(len(lanes)), values, tick_label=names)
-    plt.ylabel("# of trajectories")
-    plt.xlabel("lane of highway")
-    plt.title("distribution of lane locations")
-    plt.show()
+    bar_chart("lane_distribution", [bar_panel(values, "lane of highway", "# of trajectories",
+                                              "distribution of lane locations", tick_labels=names)])
 
 
-# calculates the conditional probability of P(B|A) and P(A|B) regarding lane change and acceleration
-def compute_and_print_conditional_prob(data):
-    # N(A + B) / N(A) = P(B | A): num acceleration and lane change / num lane change = prob accel given lane chng
+# returns the events of every trajectory that can be joined for conditional probabilities as
+# tables with columns car, start and end: 'lane change' at the moments a car leaves a lane for
+# another, and '<axis> accel' and '<axis> brake' for the acceleration and brake events of each axis
+def event_sets(store, events):
+    lane_changes = store['lane_changes']
+    car = lane_changes['car']
+
+    # the last lane of a car isn't left for another one
+    changed = np.append(car[1:] == car[:-1], False)
+    moment = lane_changes['end'][changed]
+    sets = {'lane change': {'car': car[changed], 'start': moment, 'end': moment}}
+    for var in AXES:
+        for name in 'accel', 'brake':
+            sets[f'{var} {name}'] = events[var][name]
+    return sets
+
+
+# calculates the conditional probability of P(B|A) and P(A|B) for every trajectory, along with
+# whether each one applies to the trajectory, one row per car. P(B|A) is the fraction of a car's A
+# events with a B event of the car within window seconds, and applies to cars with A events
+def count_conditional_prob(store, events, A=CONDITIONAL_EVENTS[0], B=CONDITIONAL_EVENTS[1],
+                           window=CONDITIONAL_WINDOW):
     # A = lane change
     # B = acceleration of x
-    summed_conditional_A_given_B = 0
-    summed_occurrences_A_given_B = 0
-    summed_conditional_B_given_A = 0
-    summed_occurrences_B_given_A = 0
-
-    for set in data:
-
-        event_As = set['lane_changes'][:-1] # last one isn't really a lane change
-        event_Bs = set['# x_accel']
-        num_A_and_B = 0
-        num_A = len(event_As)
-        num_B = len(event_Bs)
-
-        if num_A == 0 and num_B == 0:
-            # neither event a or b... doesn't count for anything
-            continue
-        elif num_A == 0:
-            # event b happened... acceleration but no lane change
-            summed_conditional_A_given_B += 0
-            summed_occurrences_A_given_B += 1
-        elif num_B == 0:
-            # event a happened... lane change but no accel
-            summed_conditional_B_given_A += 0
-            summed_occurrences_B_given_A += 1
-        else:
-            # there is both lane change and acceleration
-            idx_B = 0
-            for event_A in event_As:
-                lane_change_moment = event_A[2]
-
-                # if accel event within 1 sec before the lane change: count
-                # lane change moment is too far past event B at idxB
-                while idx_B < num_B and lane_change_moment - event_Bs[idx_B][2] > 1:
-                    idx_B += 1
-                if idx_B >= num_B:
-                    break
-                    # lane change in middle of acceleration event
-                    # can one accel event be related to TWO lane changes?
-                if event_Bs[idx_B][1] - 1 <= lane_change_moment <= event_Bs[idx_B][2] + 1:
-                    num_A_and_B += 1
-
-            summed_conditional_B_given_A += num_A_and_B/num_A
-            summed_conditional_A_given_B += num_A_and_B/num_B
-            summed_occurrences_A_given_B+=1
-            summed_occurrences_B_given_A+=1
+    sets = event_sets(store, events)
+    event_As, event_Bs = sets[A], sets[B]
+    num_A = np.bincount(event_As['car'], minlength=num_cars(store))
+    num_B = np.bincount(event_Bs['car'], minlength=num_cars(store))
+    A_with_B = np.bincount(event_As['car'], weights=overlaps(event_As, event_Bs, window),
+                           minlength=num_cars(store))
+    B_with_A = np.bincount(event_Bs['car'], weights=overlaps(event_Bs, event_As, window),
+                           minlength=num_cars(store))
+
+    return {
+        'B given A': A_with_B/np.maximum(num_A, 1),
+        'B given A occurrences': (num_A > 0).astype(np.int64),
+        'A given B': B_with_A/np.maximum(num_B, 1),
+        'A given B occurrences': (num_B > 0).astype(np.int64),
+    }
 
+
+# returns the conditional probabilities as (P(B|A), P(A|B)), averaged over the trajectories each one
+# applies to
+def compute_conditional_prob(results):
+    counts = results['conditional']
+    return (ratio(counts['B given A'].sum(), counts['B given A occurrences'].sum()),
+            ratio(counts['A given B'].sum(), counts['A given B occurrences'].sum()))
+
+
+# returns P(b|a) for every pair of event types as {a: {b: P(b|a)}}, averaged over the trajectories
+# with a events
+def compute_co_occurrence(results):
+    counts = results['co-occurrence']
+    matrix = {}
+    for a, row in counts.items():
+        has_a = row['#'] > 0
+        matrix[a] = {b: ratio((row[b][has_a]/row['#'][has_a]).sum(), has_a.sum())
+                     for b in row if b != '#'}
+    return matrix
+
+
+# prints P(column | row) for every pair of event types
+def print_co_occurrence(results):
+    matrix = compute_co_occurrence(results)
+    names = list(matrix)
+    print(f'P(column | row), events within {CONDITIONAL_WINDOW} s of each other:')
+    print(' '*12 + ''.join(f'{name:>12}' for name in names))
+    for a in names:
+        print(f'{a:>12}' + ''.join(f'{100*matrix[a][b]:>11.2f}%' for b in names))
+    print()
+
+
+# prints the conditional probability of P(B|A) and P(A|B) regarding lane change and acceleration
+def print_conditional_prob(results):
+    prob_B_given_A, prob_A_given_B = compute_conditional_prob(results)
     print(f'P(B|A) — the probability of acceleration given a lane change: '
-          f'{summed_conditional_B_given_A/summed_occurrences_B_given_A*100:.2f}%') #should be 0.33
+          f'{prob_B_given_A*100:.2f}%') #should be 0.33
     print(f'P(A|B) — the probability of a lane change given acceleration: '
-          f'{summed_conditional_A_given_B/summed_occurrences_A_given_B*100:.2f}%')
+          f'{prob_A_given_B*100:.2f}%')
     print()
 
 
+# divides, giving nan rather than failing when nothing was counted
+def ratio(summed, occurrences):
+    return summed/occurrences if occurrences else float('nan')
+
+
+# initializes a worker process with the store its tasks share
+def set_worker_store(store):
+    global _worker_store
+    _worker_store = store
+
+
+# collects the per-trajectory results of the trajectories in the store. every entry has one row per
+# car, or one row per lane or histogram bin in car order, so results of consecutive groups of
+# trajectories merge by concatenation with merge_results. speed and acceleration quantiles are
+# sketched with the given accuracy, and co-occurrences are only counted if asked for
+def aggregate_trajectories(store, events, accuracy=QUANTILE_ACCURACY, co_occurrence=False):
+    results = aggregate_events(store, events, co_occurrence)
+    lengths = np.diff(store['offsets'])
+    results['speed'] = group_summaries(store['speed'][2][~trajectory_heads(store)],
+                                       np.maximum(lengths-1, 0), SPEED_BIN_WIDTH, accuracy)
+    results['accel'] = group_summaries(store['accel'][2][~trajectory_heads(store, 2)],
+                                       np.maximum(lengths-2, 0), ACCEL_BIN_WIDTH, accuracy)
+    results['lanes per car'] = np.bincount(store['lane_changes']['car'], minlength=num_cars(store))
+    results['lane'] = store['lane_changes']['lane']
+    return results
+
+
+# collects the per-trajectory results that depend on the event boundaries, with the co-occurrence
+# counts of every pair of event types (see print_co_occurrence) if co_occurrence is set
+def aggregate_events(store, events, co_occurrence=False):
+    results = count_accel_events(store, events)
+    results['conditional'] = count_conditional_prob(store, events)
+    if co_occurrence:
+        results['co-occurrence'] = count_co_occurrences(event_sets(store, events),
+                                                        num_cars(store), CONDITIONAL_WINDOW)
+    return results
+
+
+# merges the results of consecutive groups of trajectories in order, giving the same results as if
+# all trajectories had been analyzed together. settings recorded in the results, such as bin
+# widths, are kept and must be the same in every group
+def merge_results(parts):
+    merged = {}
+    for key, value in parts[0].items():
+        if isinstance(value, dict):
+            merged[key] = merge_results([part[key] for part in parts])
+        elif np.ndim(value) == 0:
+            if any(part[key] != value for part in parts):
+                raise ValueError(f'results with different {key} cannot be merged')
+            merged[key] = value
+        else:
+            merged[key] = np.concatenate([part[key] for part in parts])
+    return merged
+
+
+# computes speed, acceleration, events and lane changes of the trajectories in the store and
+# returns their per-trajectory results, leaving the store as it was, with quantiles sketched with
+# the given accuracy and co-occurrences counted if asked for. each step is a stage of trace, if one
+# is given
+def analyze_trajectories(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY, lane_index=DEFAULT_LANE_INDEX,
+                         accuracy=QUANTILE_ACCURACY, trace=None, co_occurrence=False):
+    store = dict(store)
+    samples = len(store['timestamp'])
+    with stage(trace, 'compute_speed_accel', samples):
+        compute_speed_accel(store)
+    with stage(trace, 'compute_accel_events', samples):
+        events = compute_accel_events(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY)
+    with stage(trace, 'find_lane_changes', samples):
+        find_lane_changes(store, lane_index)
+    with stage(trace, 'aggregate_trajectories', num_cars(store)):
+        return aggregate_trajectories(store, events, accuracy, co_occurrence)
+
+
+# analyzes the trajectories of the store split into shards of consecutive cars spread over
+# `workers` processes. shards are merged in order, so results are identical to a serial run. with
+# workers the whole analysis is a single stage of trace
+def analyze_sharded(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY, lane_index=DEFAULT_LANE_INDEX, workers=1,
+                    accuracy=QUANTILE_ACCURACY, trace=None, co_occurrence=False):
+    if workers <= 1:
+        return analyze_trajectories(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY, lane_index, accuracy,
+                                    trace, co_occurrence)
+
+    shards = shard_bounds(store, workers*SHARDS_PER_WORKER)
+    tasks = [(first, last, BRAKE_BOUNDARY, ACCEL_BOUNDARY, lane_index, accuracy, co_occurrence)
+             for first, last in shards]
+    with stage(trace, 'analyze_sharded', len(store['timestamp'])):
+        with ProcessPoolExecutor(workers, initializer=set_worker_store, initargs=(store,)) as pool:
+            return merge_results(list(pool.map(analyze_worker_shard, tasks)))
+
+
+# analyzes one shard of the worker's store
+def analyze_worker_shard(task):
+    first, last, BRAKE_BOUNDARY, ACCEL_BOUNDARY, lane_index, accuracy, co_occurrence = task
+    shard = slice_store(_worker_store, first, last)
+    return analyze_trajectories(shard, BRAKE_BOUNDARY, ACCEL_BOUNDARY, lane_index, accuracy,
+                                co_occurrence=co_occurrence)
+
+
+# speed and acceleration of every sample, as compute_speed_accel adds them to a store
+def kinematics_stage(store):
+    store = dict(store)
+    compute_speed_accel(store)
+    return {'speed': store['speed'], 'accel': store['accel']}
+
+
+# acceleration and brake events of every trajectory, from compute_accel_events
+def events_stage(store, kinematics, BRAKE_BOUNDARY, ACCEL_BOUNDARY):
+    return compute_accel_events(dict(store, **kinematics), BRAKE_BOUNDARY, ACCEL_BOUNDARY)
+
+
+# time spent in each lane, as find_lane_changes adds it to a store
+def lane_changes_stage(store, lanes):
+    store = dict(store)
+    find_lane_changes(store, build_lane_index(lanes))
+    return store['lane_changes']
+
+
+# per-trajectory results, from aggregate_trajectories
+def aggregates_stage(store, kinematics, events, lane_changes, quantile_accuracy, co_occurrence):
+    return aggregate_trajectories(dict(store, lane_changes=lane_changes, **kinematics), events,
+                                  quantile_accuracy, co_occurrence)
+
+
+# per-trajectory results of all steps at once, computed in `workers` processes by analyze_sharded
+def sharded_aggregates_stage(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY, lanes, quantile_accuracy,
+                             co_occurrence, workers):
+    return analyze_sharded(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY, build_lane_index(lanes), workers,
+                           quantile_accuracy, co_occurrence=co_occurrence)
+
+
+# returns the stage graph of main: load -> kinematics -> events and lane changes -> aggregates,
+# where only the events depend on the boundaries and only the lane changes on the lanes. sharded
+# over several workers, the steps run together in the workers as a single stage. the graph is built
+# once and kept, so results of one call of main are reused by the next
+def analysis_graph(cache_dir=None):
+    graph = shared_graph()
+    graph['cache dir'] = cache_dir
+    return graph
+
+
+# returns the stage graph of main as it is, for other modules to reuse its results without
+# changing its settings. it is built, without a cache dir, if main hasn't run yet
+def shared_graph():
+    global _graph
+    if _graph is None:
+        _graph = new_graph()
+        add_stage(_graph, 'kinematics', kinematics_stage, ['load'])
+        add_stage(_graph, 'events', events_stage, ['load', 'kinematics'],
+                  ['BRAKE_BOUNDARY', 'ACCEL_BOUNDARY'])
+        add_stage(_graph, 'lane changes', lane_changes_stage, ['load'], ['lanes'])
+        add_stage(_graph, 'aggregates', aggregates_stage,
+                  ['load', 'kinematics', 'events', 'lane changes'],
+                  ['quantile_accuracy', 'co_occurrence'])
+        add_stage(_graph, 'sharded aggregates', sharded_aggregates_stage, ['load'],
+                  ['BRAKE_BOUNDARY', 'ACCEL_BOUNDARY', 'lanes', 'quantile_accuracy',
+                   'co_occurrence'], ['workers'])
+    return _graph
+
+
 # runs the functions in speed_accel_indiv based on pre-specified boundaries on what constitutes
-# brake and acceleration events
-def main(data, BRAKE_BOUNDARY, ACCEL_BOUNDARY):
+# brake and acceleration events. data is a list or any other iterable of car trajectories, such as
+# scene_io.iter_trajectories, or a trajectory store, such as one from scene_cache, and is not
+# modified. with workers > 1 the trajectories are analyzed in that many processes. the steps are
+# stages of analysis_graph, so calling main again on the same data with other boundaries only
+# recomputes the events and what depends on them, and only the report is redone for other print
+# options. the returned results are shared with later calls and must not be modified
+def main(data, BRAKE_BOUNDARY, ACCEL_BOUNDARY, lanes=LANES, workers=1):
     config = {
-        'print': 1
+        'print': 1,
+        # also count and print how often every pair of event types happen close together, which
+        # takes about as long as the rest of the event analysis
+        'co_occurrence': 0,
+        # relative accuracy of the reported speed and acceleration percentiles (see running_stats)
+        'quantile_accuracy': QUANTILE_ACCURACY,
+        # also keep the results of every stage in this directory (such as stages.CACHE_DIR), so
+        # later runs on the same scene skip the stages whose parameters are unchanged
+        'stage_cache_dir': None,
+        # time every stage and write a json trace of the run to instrument.TRACE_DIR, optionally
+        # tracing python memory allocations too
+        'instrument': 0,
+        'instrument_memory': 0,
     }
 
-    compute_speed_accel(data)
+    trace = (new_trace('speed_accel_indiv', config['instrument_memory']) if config['instrument']
+             else None)
 
-    vars = ['x', 'y', 'ttl']
-    for var in vars:
-        compute_accel_events(data, var, BRAKE_BOUNDARY, ACCEL_BOUNDARY)
-        compute_accel_percentage(data, var)
+    lane_index = build_lane_index(lanes)
+    with stage(trace, 'load'):
+        store = as_trajectory_store(data)
+        sources = {'load': (store, store_key(store))}
+    params = {'BRAKE_BOUNDARY': BRAKE_BOUNDARY, 'ACCEL_BOUNDARY': ACCEL_BOUNDARY, 'lanes': lanes,
+              'quantile_accuracy': config['quantile_accuracy'],
+              'co_occurrence': bool(config['co_occurrence']), 'workers': workers}
+    results = evaluate(analysis_graph(config['stage_cache_dir']),
+                       'aggregates' if workers <= 1 else 'sharded aggregates', params, sources,
+                       trace)
 
-    find_lane_changes(data)
-    compute_and_print_conditional_prob(data)
+    with stage(trace, 'print_conditional_prob'):
+        print_conditional_prob(results)
 
     if config['print']:
-        print_speed_accel(data)
-        print_lane_changes(data)
-
-        for var in vars:
-            print_accel_event_stats(data, var)
-
+        with stage(trace, 'print_speed_accel'):
+            print_speed_accel(results)
+        with stage(trace, 'print_lane_changes'):
+            print_lane_changes(results, lane_index)
+
+        with stage(trace, 'print_accel_event_stats'):
+            for var in AXES:
+                print_accel_event_stats(results, var)
+
+    if config['co_occurrence']:
+        with stage(trace, 'print_co_occurrence'):
+            print_co_occurrence(results)
+
+    if trace is not None:
+        finish_trace(trace)
+    return results
+
+
+# evaluates event detection, time in events and the conditional probabilities for every
+# (BRAKE_BOUNDARY, ACCEL_BOUNDARY) pair in boundaries. speed, acceleration and lane changes do not
+# depend on the boundaries, so they are computed once and shared by all pairs, which are spread over
+# `workers` processes when workers > 1. returns a table keyed by boundary pair
+def sweep_boundaries(data, boundaries, lanes=LANES, workers=1):
+    store = as_trajectory_store(data)
+    compute_speed_accel(store)
+    find_lane_changes(store, build_lane_index(lanes))
+
+    boundaries = [tuple(pair) for pair in boundaries]
+    if workers > 1:
+        with ProcessPoolExecutor(workers, initializer=set_worker_store, initargs=(store,)) as pool:
+            results = list(pool.map(evaluate_sweep_boundaries, boundaries))
+    else:
+        results = [evaluate_boundaries(store, *pair) for pair in boundaries]
+    return dict(zip(boundaries, results))
+
+
+# computes the results of a single boundary pair of a sweep
+def evaluate_boundaries(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY):
+    results = aggregate_events(store, compute_accel_events(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY))
+    result = {var: summarize_accel_events(results, var) for var in AXES}
+    result['P(B|A)'], result['P(A|B)'] = compute_conditional_prob(results)
+    return result
+
+
+# evaluates a boundary pair in a sweep worker process
+def evaluate_sweep_boundaries(pair):
+    return evaluate_boundaries(_worker_store, *pair)
+
+
+# prints one line per boundary pair of a sweep with its overall event statistics
+def print_sweep(table):
+    print(f"{'brake':>7} {'accel':>7} {'# accel':>8} {'# brake':>8} {'% accel':>8} "
+          f"{'% brake':>8} {'P(B|A)':>8} {'P(A|B)':>8}")
+    for (brake, accel), result in table.items():
+        summary = result['ttl']
+        print(f"{brake:>7.2f} {accel:>7.2f} {summary['# accel']:>8} {summary['# brake']:>8} "
+              f"{100*summary['% accel']:>7.2f}% {100*summary['% brake']:>7.2f}% "
+              f"{100*result['P(B|A)']:>7.2f}% {100*result['P(A|B)']:>7.2f}%")
+    print()
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import pickle
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from instrument import stage
+
+# bytes of stage results kept in memory; the least recently used are dropped beyond it
+MEMORY_BUDGET = 2 * 1024**3
+
+# where stage results are kept on disk when a graph is given a cache_dir
+CACHE_DIR = '.stage_cache'
+
+
+# creates an empty stage graph. results of memoized stages are kept in memory, the most recently
+# used first up to memory_budget bytes, and with a cache_dir also on disk, so later runs pick them
+# up
+def new_graph(memory_budget=MEMORY_BUDGET, cache_dir=None):
+    return {
+        'stages': {},
+        'memory': OrderedDict(),
+        'bytes': 0,
+        'budget': memory_budget,
+        'cache dir': cache_dir,
+        # how many times each stage was actually computed
+        'computed': {},
+    }
+
+
+# declares a stage computing fn(*results of inputs, **params), where params are looked up by name
+# in the params given to evaluate. the stage's result is keyed on its name, version, params and
+# the keys of its inputs, so it's only recomputed when one of them changes. options are passed to
+# fn like params but are not part of the key, for settings that don't change the result, such as
+# a number of workers. a stage that isn't memoized runs on every evaluate, for side effects such as
+# printing. results are shared between runs, so they must not be modified
+def add_stage(graph, name, fn, inputs=(), params=(), options=(), memoize=True, version=1):
+    graph['stages'][name] = {'fn': fn, 'inputs': tuple(inputs), 'params': tuple(params),
+                             'options': tuple(options), 'memoize': memoize, 'version': version}
+
+
+# returns the key of a stage's result for the given params and sources, or None if it depends on a
+# source without a key
+def stage_key(graph, name, params, sources):
+    if name in sources:
+        return sources[name][1]
+    spec = graph['stages'][name]
+    input_keys = [stage_key(graph, source, params, sources) for source in spec['inputs']]
+    if None in input_keys:
+        return None
+    description = [name, spec['version'], {param: params[param] for param in spec['params']},
+                   input_keys]
+    description = json.dumps(description, sort_keys=True, default=str)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+# returns the result of a stage, from memory or disk if it was memoized for the same key and
+# otherwise computed, after its inputs, as a stage of trace. inputs of a memoized result are not
+# evaluated at all. sources are the inputs of the graph, such as the loaded scene, as name:
+# (value, key), where key identifies the content of the value so stages downstream of an
+# unchanged source are found memoized. stages downstream of a source with no key, such as a
+# stream, are always computed
+def evaluate(graph, name, params, sources, trace=None):
+    if name in sources:
+        return sources[name][0]
+    spec = graph['stages'][name]
+    key = stage_key(graph, name, params, sources) if spec['memoize'] else None
+    if key is not None:
+        found, value = recall(graph, key)
+        if found:
+            return value
+
+    inputs = [evaluate(graph, source, params, sources, trace) for source in spec['inputs']]
+    with stage(trace, name):
+        value = spec['fn'](*inputs, **{param: params[param]
+                                       for param in spec['params'] + spec['options']})
+    graph['computed'][name] = graph['computed'].get(name, 0) + 1
+
+    if key is not None:
+        remember(graph, key, value)
+    return value
+
+
+# looks a result up in memory, then on disk, returning whether it was found and the result
+def recall(graph, key):
+    memory = graph['memory']
+    if key in memory:
+        memory.move_to_end(key)
+        return True, memory[key][0]
+
+    path = cache_path(graph, key)
+    if path is None or not os.path.exists(path):
+        return False, None
+    try:
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return False, None
+    keep_in_memory(graph, key, value)
+    return True, value
+
+
+# memoizes a result in memory and, with a cache_dir, on disk
+def remember(graph, key, value):
+    keep_in_memory(graph, key, value)
+    path = cache_path(graph, key)
+    if path is not None:
+        os.makedirs(graph['cache dir'], exist_ok=True)
+        # written in one step so other runs never read it half written
+        tmp = f'{path}.tmp-{os.getpid()}'
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+
+# keeps a result in memory, dropping the least recently used results until the memory budget is
+# met. a result larger than the whole budget isn't kept
+def keep_in_memory(graph, key, value):
+    size = result_size(value)
+    if size > graph['budget']:
+        return
+    memory = graph['memory']
+    memory[key] = (value, size)
+    graph['bytes'] += size
+    while graph['bytes'] > graph['budget']:
+        old_key, (old_value, old_size) = memory.popitem(last=False)
+        graph['bytes'] -= old_size
+
+
+# drops every result kept in memory
+def clear_memory(graph):
+    graph['memory'].clear()
+    graph['bytes'] = 0
+
+
+# file a result is kept in on disk, or None without a cache_dir
+def cache_path(graph, key):
+    if graph['cache dir'] is None:
+        return None
+    return os.path.join(graph['cache dir'], f'{key}.pkl')
+
+
+# approximate size of a result in bytes: numpy arrays count their data, and long lists are
+# estimated from their first element rather than walked
+def result_size(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(result_size(key) + result_size(item)
+                                          for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        if not value:
+            return sys.getsizeof(value)
+        return sys.getsizeof(value) + len(value)*result_size(value[0])
+    return sys.getsizeof(value)
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import analysis_by_timestamp
+from benchmark import synthetic_scene
+from frame_store import iter_frame_dicts
+from lanes import build_lane_index
+from trajectory_store import build_trajectory_store
+from transpose import frames_from_trajectories
+
+
+# sampled at the default rate and at full resolution
+@pytest.mark.parametrize('follow_rate', [analysis_by_timestamp.FOLLOW_DISTANCE_RATE, None])
+def test_chunked_tracking_matches_serial(follow_rate):
+    store, lanes = synthetic_scene(num_cars=150, duration=10, seed=4)
+    frames = frames_from_trajectories(store)
+    lane_index = build_lane_index(lanes)
+
+    serial = analysis_by_timestamp.new_tracker(lane_index, follow_rate=follow_rate)
+    for set in iter_frame_dicts(frames):
+        analysis_by_timestamp.track_frame(serial, set)
+    # several chunks per worker, so leader intervals span chunk boundaries
+    chunked = analysis_by_timestamp.track_chunked(frames, lane_index, follow_rate=follow_rate,
+                                                  workers=2)
+
+    assert analysis_by_timestamp.current_state(chunked) == \
+        analysis_by_timestamp.current_state(serial)
+    expected = analysis_by_timestamp.follow_distance_table(serial)
+    got = analysis_by_timestamp.follow_distance_table(chunked)
+    assert all(np.array_equal(got[column], expected[column]) for column in expected)
+    assert (list(analysis_by_timestamp.finish_tracker(chunked).items()) ==
+            list(analysis_by_timestamp.finish_tracker(serial).items()))
+
+
+def test_chunked_tracking_keeps_mixed_car_ids():
+    store, lanes = synthetic_scene(num_cars=40, duration=4, seed=5)
+    store['ids'] = [i if i % 2 else f'{i:024x}' for i in range(len(store['ids']))]
+    frames = frames_from_trajectories(store)
+    lane_index = build_lane_index(lanes)
+
+    serial = analysis_by_timestamp.new_tracker(lane_index)
+    for set in iter_frame_dicts(frames):
+        analysis_by_timestamp.track_frame(serial, set)
+    chunked = analysis_by_timestamp.track_chunked(frames, lane_index, workers=2)
+    assert (list(analysis_by_timestamp.finish_tracker(chunked).items()) ==
+            list(analysis_by_timestamp.finish_tracker(serial).items()))
+
+
+def test_columns_leave_out_cars_never_in_a_lane(tmp_path):
+    cars = [{'_id': {'$oid': 'a'}, 'timestamp': [1.0, 1.04, 1.08], 'x_position': [0.0, 1.0, 2.0],
+             'y_position': [6.0, 6.0, 6.0]},
+            {'_id': {'$oid': 'b'}, 'timestamp': [1.0, 1.04, 1.08], 'x_position': [5.0, 6.0, 7.0],
+             'y_position': [6.0, 6.0, 6.0]},
+            # off every lane at every timestamp
+            {'_id': {'$oid': 'c'}, 'timestamp': [1.0, 1.04, 1.08], 'x_position': [5.0, 6.0, 7.0],
+             'y_position': [200.0, 200.0, 200.0]}]
+    frames = frames_from_trajectories(build_trajectory_store(cars))
+    by_car_by_timestamp, follow = analysis_by_timestamp.track_scene(frames, {'L1': [0, 12]})
+
+    path = str(tmp_path / 'columns')
+    analysis_by_timestamp.create_newfile_columns(path, by_car_by_timestamp, follow)
+    results = analysis_by_timestamp.read_newfile_columns(path)
+    assert analysis_by_timestamp.columns_to_dictionary(results) == by_car_by_timestamp
+
+
+def test_columns_round_trip_in_chunks(tmp_path, monkeypatch):
+    store, lanes = synthetic_scene(num_cars=150, duration=10, seed=11)
+    by_car_by_timestamp, follow = analysis_by_timestamp.track_scene(
+        frames_from_trajectories(store), lanes)
+    # many chunks of rows
+    monkeypatch.setattr(analysis_by_timestamp, 'NEW_FILE_CHUNK_ROWS', 50)
+
+    path = str(tmp_path / 'columns')
+    analysis_by_timestamp.create_newfile_columns(path, by_car_by_timestamp, follow)
+    results = analysis_by_timestamp.read_newfile_columns(path)
+    assert analysis_by_timestamp.columns_to_dictionary(results) == by_car_by_timestamp
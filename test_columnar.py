@@ -0,0 +1,23 @@
+import numpy as np
+
+from columnar import close_table, open_table, read_table, write_rows
+
+
+def test_table_written_in_chunks_reads_back_whole(tmp_path):
+    rng = np.random.default_rng(10)
+    car, time = rng.integers(-1, 500, 1000), rng.uniform(0, 1e9, 1000)
+    writer = open_table(str(tmp_path / 'table'), {'car': np.int32, 'time': np.float64})
+    for first in range(0, 1000, 300):
+        write_rows(writer, {'car': car[first:first+300], 'time': time[first:first+300]})
+    close_table(writer, source='test')
+
+    columns, meta = read_table(str(tmp_path / 'table'))
+    assert meta['rows'] == 1000 and meta['source'] == 'test'
+    assert columns['car'].dtype == np.int32 and np.array_equal(columns['car'], car)
+    assert np.array_equal(columns['time'], time)
+
+
+def test_empty_table_reads_back_empty(tmp_path):
+    close_table(open_table(str(tmp_path / 'table'), {'car': np.int32}))
+    columns, meta = read_table(str(tmp_path / 'table'))
+    assert len(columns['car']) == 0 and columns['car'].dtype == np.int32
@@ -0,0 +1,64 @@
+import math
+
+import numpy as np
+
+import headway
+import speed_accel_indiv
+from benchmark import synthetic_scene
+from lanes import build_lane_index
+from transpose import frames_from_trajectories
+
+
+# gap, time headway and time to collision of every follower-leader pair where both cars have a
+# speed, found frame by frame: the cars of each lane sorted by x, the follower being the one behind
+# in the direction both travel, with speeds taken from the car's previous sample
+def reference_headways(store, lanes):
+    samples = {}
+    for car, (lo, hi) in enumerate(zip(store['offsets'][:-1], store['offsets'][1:])):
+        for i in range(lo, hi):
+            speed = None
+            if i > lo:
+                speed = ((store['x'][i] - store['x'][i-1]) /
+                         (store['timestamp'][i] - store['timestamp'][i-1]))
+            lane = [name for name, (lower, upper) in lanes.items()
+                    if lower < store['y'][i] <= upper]
+            if lane:
+                samples.setdefault((store['timestamp'][i], lane[0]), []).append(
+                    (store['x'][i], car, speed))
+
+    pairs = {}
+    for (time, lane), cars in samples.items():
+        cars.sort()
+        for (x_behind, behind, speed_behind), (x_ahead, ahead, speed_ahead) in zip(cars,
+                                                                                 cars[1:]):
+            if speed_behind is None or speed_ahead is None:
+                continue
+            direction = -1 if speed_behind + speed_ahead < 0 else 1
+            follower, leader = (behind, ahead) if direction > 0 else (ahead, behind)
+            follower_speed = direction*(speed_behind if direction > 0 else speed_ahead)
+            closing_speed = follower_speed - direction*(speed_ahead if direction > 0
+                                                        else speed_behind)
+            gap = x_ahead - x_behind
+            pairs[time, follower, leader] = (
+                gap, gap/follower_speed if follower_speed > 0 else math.inf,
+                gap/closing_speed if closing_speed > 0 else math.inf)
+    return pairs
+
+
+def test_headways_match_a_scan_of_every_frame():
+    store, lanes = synthetic_scene(num_cars=80, duration=6, seed=9)
+    # the cars of the upper half of the road drive towards decreasing x
+    upper = np.repeat(store['y'][store['offsets'][:-1]] > 36, np.diff(store['offsets']))
+    store['x'] = np.where(upper, -store['x'], store['x'])
+    speed_accel_indiv.compute_speed_accel(store)
+    headways = headway.compute_headways(store, frames_from_trajectories(store), store['speed'],
+                                        build_lane_index(lanes))
+
+    expected = reference_headways(store, lanes)
+    got = {(time, car, leader): (gap, time_headway, ttc)
+           for time, car, leader, gap, time_headway, ttc in zip(
+               *(headways[column].tolist() for column in
+                 ('time', 'car', 'leader', 'gap', 'headway', 'ttc')))
+           if not math.isnan(time_headway)}
+    assert got.keys() == expected.keys()
+    assert all(np.allclose(got[key], value, rtol=1e-9) for key, value in expected.items())
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from interval_join import count_co_occurrences, overlaps
+
+
+# a table of random events of a few cars on a quarter-second grid, so many of them touch exactly,
+# a third of them point events
+def random_events(rng, size):
+    start = rng.integers(0, 80, size)/4
+    end = start + np.where(rng.random(size) < 1/3, 0, rng.integers(1, 12, size)/4)
+    return {'car': rng.integers(0, 5, size), 'start': start, 'end': end}
+
+
+@pytest.mark.parametrize('window', [0, 0.5])
+def test_overlaps_matches_a_scan(window):
+    rng = np.random.default_rng(7)
+    left, right = random_events(rng, 200), random_events(rng, 60)
+    expected = [any(car == right_car and start <= right_end + window and
+                    end >= right_start - window
+                    for right_car, right_start, right_end in
+                    zip(right['car'], right['start'], right['end']))
+                for car, start, end in zip(left['car'], left['start'], left['end'])]
+    assert overlaps(left, right, window).tolist() == expected
+
+
+def test_co_occurrences_count_overlaps_per_car():
+    rng = np.random.default_rng(8)
+    sets = {'a': random_events(rng, 50), 'b': random_events(rng, 30)}
+    counts = count_co_occurrences(sets, 6, 0.5)
+    assert all(np.array_equal(counts[a][b], np.bincount(sets[a]['car'][
+        overlaps(sets[a], sets[b], 0.5)], minlength=6)) for a in sets for b in sets)
@@ -0,0 +1,58 @@
+import numpy as np
+
+import analysis_by_timestamp
+import leader_index
+from benchmark import synthetic_scene
+from transpose import frames_from_trajectories
+
+
+# leaders and follow distances of a synthetic scene, as analysis_by_timestamp returns them, with
+# their index and a few hundred query times, including the ends of every interval
+def indexed_scene():
+    store, lanes = synthetic_scene(num_cars=120, duration=8, seed=6)
+    by_car_by_timestamp, follow = analysis_by_timestamp.track_scene(
+        frames_from_trajectories(store), lanes)
+    index = leader_index.build_leader_index(by_car_by_timestamp, follow)
+
+    rng = np.random.default_rng(0)
+    ends = [time for car in by_car_by_timestamp.values() for leader, start, end in car['leader']
+            for time in (start, end)]
+    times = np.concatenate([rng.uniform(store['timestamp'].min() - 1,
+                                        store['timestamp'].max() + 1, 200),
+                            rng.choice(ends, 200)])
+    return by_car_by_timestamp, index, times
+
+
+def test_leaders_at_matches_a_scan():
+    by_car_by_timestamp, index, times = indexed_scene()
+    car_ids = list(by_car_by_timestamp) + ['not a car']
+    cars = [car_ids[i % len(car_ids)] for i in range(len(times))]
+
+    expected = []
+    for car_id, time in zip(cars, times.tolist()):
+        leaders = [leader for leader, start, end in
+                   by_car_by_timestamp.get(car_id, {'leader': []})['leader']
+                   if start <= time <= end]
+        expected.append(leaders[-1] if leaders else None)
+    assert leader_index.leaders_at(index, cars, times) == expected
+
+
+def test_following_between_matches_a_scan():
+    by_car_by_timestamp, index, times = indexed_scene()
+    for t1, t2 in zip(times[::2].tolist(), times[1::2].tolist()):
+        t1, t2 = min(t1, t2), max(t1, t2)
+        expected = [(car_id, leader, start, end) for car_id, car in by_car_by_timestamp.items()
+                    for leader, start, end in car['leader']
+                    if leader is not None and start <= t2 and end >= t1]
+        assert sorted(leader_index.following_between(index, t1, t2)) == sorted(expected)
+
+
+def test_pair_intervals_and_follow_distances_match_a_scan():
+    by_car_by_timestamp, index, times = indexed_scene()
+    t1, t2 = np.percentile(times, [30, 60]).tolist()
+    for car_id, car in by_car_by_timestamp.items():
+        for leader_id in {leader for leader, start, end in car['leader']}:
+            assert leader_index.pair_intervals(index, car_id, leader_id) == [
+                (start, end) for leader, start, end in car['leader'] if leader == leader_id]
+        assert leader_index.follow_distances(index, car_id, t1, t2) == [
+            row for row in car.get('follow distance', []) if t1 <= row[2] <= t2]
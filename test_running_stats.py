@@ -0,0 +1,52 @@
+import json
+
+import numpy as np
+import pytest
+
+from running_stats import (SKETCH_MIN_VALUE, accumulator_from_dict, accumulator_to_dict,
+                           add_group_summaries, add_values, group_summaries, merge_accumulators,
+                           new_accumulator, quantiles)
+
+QS = np.linspace(0, 1, 101)
+
+
+# values of both signs spanning several orders of magnitude, with some exact zeros
+def sample_values(seed=0):
+    rng = np.random.default_rng(seed)
+    return np.concatenate([rng.normal(0, 3, 3000), rng.lognormal(2, 1.5, 2000),
+                           -rng.lognormal(0, 2, 1000), np.zeros(50)])
+
+
+@pytest.mark.parametrize('accuracy', [0.01, 0.05])
+def test_quantiles_are_within_accuracy(accuracy):
+    values = sample_values()
+    acc = add_values(new_accumulator(1, accuracy), values)
+    # the value of rank q*(count-1)
+    exact = np.sort(values)[np.floor(QS*(len(values) - 1)).astype(int)]
+    error = np.abs(np.array(quantiles(acc, QS)) - exact)
+    assert (error <= accuracy*np.abs(exact) + SKETCH_MIN_VALUE).all()
+
+
+def test_merged_sketches_equal_one_pass():
+    values = sample_values(1)
+    whole = add_values(new_accumulator(), values)
+
+    merged = new_accumulator()
+    for part in np.array_split(values, 7):
+        merge_accumulators(merged, add_values(new_accumulator(), part))
+    assert merged['sketch'] == whole['sketch']
+
+    sizes = np.diff(np.linspace(0, len(values), 12).astype(int))
+    groups = add_group_summaries(new_accumulator(), group_summaries(values, sizes))
+    assert groups['sketch'] == whole['sketch']
+
+
+def test_sketch_survives_a_json_round_trip():
+    acc = add_values(new_accumulator(0.5, 0.02), sample_values(2))
+    restored = accumulator_from_dict(json.loads(json.dumps(accumulator_to_dict(acc))))
+    assert quantiles(restored, QS) == quantiles(acc, QS)
+
+
+def test_sketches_of_different_accuracy_do_not_merge():
+    with pytest.raises(ValueError):
+        merge_accumulators(new_accumulator(1, 0.01), new_accumulator(1, 0.02))
@@ -0,0 +1,26 @@
+import json
+
+import numpy as np
+
+import scene_cache
+import scene_io
+from trajectory_store import build_trajectory_store
+
+
+def test_cached_store_keeps_car_ids(tmp_path):
+    cars = [{'_id': {'$oid': '630e7f2516599e2c33900001'}, 'timestamp': [1.0, 1.04, 1.08],
+             'x_position': [0.0, 1.0, 2.0], 'y_position': [6.0, 6.0, 6.0]},
+            {'_id': 7, 'timestamp': [1.0, 1.04], 'x_position': [5.0, 6.0],
+             'y_position': [18.0, 18.0]},
+            {'timestamp': [1.04, 1.08], 'x_position': [9.0, 10.0], 'y_position': [30.0, 30.0]}]
+    path = str(tmp_path / 'scene.json')
+    with open(path, 'w') as f:
+        json.dump(cars, f)
+
+    uncached = build_trajectory_store(scene_io.iter_trajectories(path))
+    # converted on the first load, memory-mapped on the second
+    for _ in range(2):
+        cached = scene_cache.load_trajectory_store(path, str(tmp_path / 'cache'))
+        assert cached['ids'] == uncached['ids'] == ['630e7f2516599e2c33900001', 7, 2]
+        for name in 'offsets', 'timestamp', 'x', 'y':
+            assert np.array_equal(cached[name], uncached[name])
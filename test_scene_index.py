@@ -0,0 +1,40 @@
+import json
+import warnings
+
+import numpy as np
+
+import scene_index
+import speed_accel_indiv
+from benchmark import EPOCH, synthetic_scene
+from trajectory_store import num_cars
+
+
+# writes a trajectory store to path as a by-car scene file
+def write_scene(path, store):
+    offsets = store['offsets']
+    with open(path, 'w') as f:
+        json.dump([{'_id': {'$oid': car_id},
+                    'timestamp': store['timestamp'][lo:hi].tolist(),
+                    'x_position': store['x'][lo:hi].tolist(),
+                    'y_position': store['y'][lo:hi].tolist()}
+                   for car_id, lo, hi in zip(store['ids'], offsets[:-1], offsets[1:])], f)
+
+
+def test_narrow_window_leaves_out_short_cars(tmp_path):
+    store, lanes = synthetic_scene(num_cars=200, duration=10, seed=1)
+    path = str(tmp_path / 'scene.json')
+    write_scene(path, store)
+
+    # a tenth of a second holds at most 3 samples of a car, fewer for cars entering or leaving
+    subset = scene_index.load_trajectories(path, (EPOCH + 5, EPOCH + 5.1), lanes=lanes,
+                                           cache_dir=str(tmp_path / 'cache'))
+    assert num_cars(subset) > 0
+    assert np.diff(subset['offsets']).min() >= scene_index.MIN_SAMPLES
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        speed_accel_indiv.compute_speed_accel(subset)
+        events = speed_accel_indiv.compute_accel_events(subset, -3, 2.25)
+    for var in speed_accel_indiv.AXES:
+        assert np.isfinite(events[var]['% accel']).all()
+        assert np.isfinite(events[var]['% brake']).all()
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+import scene_io
+
+# elements with numbers, nesting and multi-byte characters, written with uneven whitespace so
+# chunks end in the middle of all of them
+ELEMENTS = [{'_id': {'$oid': 'é'*i}, 'timestamp': [1623877091.04*i, -0.5e-3],
+             'x_position': [123456.789, i], 'name': 'ü ∑ 🚗'[:i % 5]} for i in range(12)]
+
+
+def write_array(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(' [\n' + ' ,\n\t'.join(json.dumps(element, ensure_ascii=False)
+                                        for element in ELEMENTS) + '\r\n]\n')
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, scene_io.CHUNK_SIZE])
+def test_elements_are_streamed_whole(tmp_path, chunk_size):
+    path = str(tmp_path / 'scene.json')
+    write_array(path)
+    assert list(scene_io.iter_json_array(path, chunk_size)) == ELEMENTS
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64])
+def test_offsets_locate_every_element(tmp_path, chunk_size):
+    path = str(tmp_path / 'scene.json')
+    write_array(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    located = list(scene_io.iter_json_array(path, chunk_size, offsets=True))
+    assert [json.loads(data[start:end]) for item, start, end in located] == ELEMENTS
+    # reading from the start of one element up to the start of another gives the ones between
+    starts = [start for item, start, end in located]
+    assert list(scene_io.iter_json_array(path, chunk_size, starts[3], starts[9])) == ELEMENTS[3:9]
+    assert list(scene_io.iter_json_array(path, chunk_size, starts[5])) == ELEMENTS[5:]
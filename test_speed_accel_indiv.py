@@ -0,0 +1,136 @@
+import math
+
+import numpy as np
+
+import speed_accel_indiv
+from benchmark import synthetic_scene
+from lanes import build_lane_index
+from running_stats import add_group_summaries, new_accumulator
+from speed_accel_indiv import AXES, FEET_PER_MILE, SECONDS_PER_HR
+
+# boundaries low enough for the synthetic scene to have many events, including jumps straight from
+# braking to accelerating on the y axis
+BRAKE_BOUNDARY, ACCEL_BOUNDARY = -1, 1
+
+
+# speed and acceleration of one trajectory as (x, y, total) tuples, sample by sample as the
+# per-trajectory loop computed them before it was vectorized
+def reference_speed_accel(timestamp, x_pos, y_pos):
+    speed = [(0, 0, 0)]
+    accel = [(0, 0, 0), (0, 0, 0)]
+    for i in range(1, len(timestamp)):
+        y_dist = (y_pos[i]-y_pos[i-1])/FEET_PER_MILE
+        x_dist = (x_pos[i]-x_pos[i-1])/FEET_PER_MILE
+        delta_dist = math.sqrt(x_dist**2+y_dist**2)
+        delta_time = timestamp[i]-timestamp[i-1]
+        speed.append((x_dist/delta_time*SECONDS_PER_HR, y_dist/delta_time*SECONDS_PER_HR,
+                      delta_dist/delta_time*SECONDS_PER_HR))
+        if i == 1:
+            continue
+        accel.append(tuple((speed[i][axis] - speed[i-1][axis])*(FEET_PER_MILE/SECONDS_PER_HR) /
+                           delta_time for axis in range(3)))
+    return speed, accel[:len(timestamp)]
+
+
+# accel and brake events of one trajectory on one axis as (mean, start, end) tuples, found by the
+# per-sample state machine the run-length-encoded pass replaced
+def reference_accel_events(timestamp, accel):
+    events = {'accel': [], 'brake': []}
+    b, a, event = False, False, False
+    start_time, running_sum, running_count = 0, 0, 0
+    index = 0
+    while index < len(accel):
+        pt = accel[index]
+        if event and (((a and pt < ACCEL_BOUNDARY) or (b and pt > BRAKE_BOUNDARY)) or
+                      index == len(accel)-1):
+            end_idx = index
+            # a jump from braking to accelerating ends the event and begins the next one here
+            if (a and pt <= BRAKE_BOUNDARY) or (b and pt >= ACCEL_BOUNDARY):
+                index -= 1
+            cur = (running_sum/running_count, start_time, timestamp[end_idx])
+            if running_sum < 0:
+                events['brake'].append(cur)
+                b = False
+            else:
+                events['accel'].append(cur)
+                a = False
+            event = False
+            running_sum, running_count = 0, 0
+        elif not event and pt >= ACCEL_BOUNDARY or pt <= BRAKE_BOUNDARY:
+            event = True
+            start_time = timestamp[index]
+            running_sum += pt
+            running_count += 1
+            if pt >= ACCEL_BOUNDARY:
+                a = True
+            else:
+                b = True
+        elif event and index != len(accel)-1:
+            running_sum += pt
+            running_count += 1
+        index += 1
+    return events
+
+
+def test_vectorized_speed_accel_matches_reference():
+    store, lanes = synthetic_scene(num_cars=100, duration=10, seed=2)
+    speed_accel_indiv.compute_speed_accel(store)
+
+    expected_speed, expected_accel = [], []
+    offsets = store['offsets']
+    for lo, hi in zip(offsets[:-1], offsets[1:]):
+        speed, accel = reference_speed_accel(store['timestamp'][lo:hi], store['x'][lo:hi],
+                                             store['y'][lo:hi])
+        expected_speed += speed
+        expected_accel += accel
+    assert np.allclose(store['speed'], np.transpose(expected_speed), rtol=1e-9, atol=1e-9)
+    assert np.allclose(store['accel'], np.transpose(expected_accel), rtol=1e-9, atol=1e-6)
+
+
+def test_accel_events_match_reference():
+    store, lanes = synthetic_scene(num_cars=100, duration=10, seed=2)
+    speed_accel_indiv.compute_speed_accel(store)
+    events = speed_accel_indiv.compute_accel_events(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY)
+
+    offsets, timestamp = store['offsets'], store['timestamp']
+    for var, axis in AXES.items():
+        for car, (lo, hi) in enumerate(zip(offsets[:-1], offsets[1:])):
+            expected = reference_accel_events(timestamp[lo:hi], store['accel'][axis][lo:hi])
+            total_time = timestamp[hi-1] - timestamp[lo]
+            for name in 'accel', 'brake':
+                table = events[var][name]
+                rows = table['car'] == car
+                got = np.stack([table[column][rows] for column in ('mean', 'start', 'end')], 1)
+                assert np.allclose(got, np.reshape(expected[name], (-1, 3)), rtol=1e-9)
+                time_in_event = sum(end - start for mean, start, end in expected[name])
+                assert math.isclose(events[var]['% ' + name][car], time_in_event/total_time,
+                                    abs_tol=1e-12)
+
+
+# folds every table of group summaries in results into an accumulator, since their histogram bins
+# are listed per table and so depend on how the trajectories were split
+def fold_group_summaries(results):
+    if 'sketch bins' in results:
+        return add_group_summaries(new_accumulator(results['width'], results['accuracy']), results)
+    return {key: fold_group_summaries(value) if isinstance(value, dict) else value
+            for key, value in results.items()}
+
+
+# names the entries of two results that differ
+def differences(expected, got, prefix=''):
+    if isinstance(expected, dict):
+        if set(expected) != set(got):
+            return [prefix]
+        return [name for key in expected
+                for name in differences(expected[key], got[key], f'{prefix}/{key}')]
+    return [] if np.array_equal(expected, got, equal_nan=True) else [prefix]
+
+
+def test_sharded_analysis_matches_serial():
+    store, lanes = synthetic_scene(num_cars=200, duration=10, seed=3)
+    lane_index = build_lane_index(lanes)
+    serial = speed_accel_indiv.analyze_trajectories(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY,
+                                                    lane_index, co_occurrence=True)
+    sharded = speed_accel_indiv.analyze_sharded(store, BRAKE_BOUNDARY, ACCEL_BOUNDARY, lane_index,
+                                                workers=2, co_occurrence=True)
+    assert differences(fold_group_summaries(serial), fold_group_summaries(sharded)) == []
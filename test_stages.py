@@ -0,0 +1,55 @@
+import numpy as np
+
+from stages import add_stage, clear_memory, evaluate, new_graph
+
+
+# load -> scaled -> total, and a report that runs every time. scaled depends on factor and total on
+# offset, while workers is an option
+def counting_graph(cache_dir=None, memory_budget=2**20):
+    graph = new_graph(memory_budget, cache_dir)
+    add_stage(graph, 'scaled', lambda values, factor, workers: values*factor, ['load'], ['factor'],
+              ['workers'])
+    add_stage(graph, 'total', lambda scaled, offset: float(scaled.sum()) + offset, ['scaled'],
+              ['offset'])
+    add_stage(graph, 'report', lambda total: f'{total:.1f}', ['total'], memoize=False)
+    return graph
+
+
+PARAMS = {'factor': 2, 'offset': 1, 'workers': 1}
+
+
+def test_only_stages_downstream_of_a_change_are_recomputed():
+    graph = counting_graph()
+    sources = {'load': (np.arange(4.0), 'scene')}
+    assert evaluate(graph, 'report', PARAMS, sources) == '13.0'
+    evaluate(graph, 'report', dict(PARAMS, workers=4), sources)
+    evaluate(graph, 'report', dict(PARAMS, offset=2), sources)
+    assert graph['computed'] == {'scaled': 1, 'total': 2, 'report': 3}
+
+
+def test_sources_without_a_key_are_always_computed():
+    graph = counting_graph()
+    for _ in range(2):
+        evaluate(graph, 'total', PARAMS, {'load': (np.arange(4.0), None)})
+    assert graph['computed'] == {'scaled': 2, 'total': 2}
+
+
+def test_results_on_disk_are_picked_up_by_a_new_graph(tmp_path):
+    sources = {'load': (np.arange(4.0), 'scene')}
+    evaluate(counting_graph(str(tmp_path)), 'total', PARAMS, sources)
+    graph = counting_graph(str(tmp_path))
+    assert evaluate(graph, 'total', PARAMS, sources) == 13.0
+    assert graph['computed'] == {}
+
+
+def test_results_beyond_the_memory_budget_are_recomputed():
+    graph = counting_graph(memory_budget=10000)
+    for scene in 'a', 'b', 'a':
+        evaluate(graph, 'scaled', PARAMS, {'load': (np.arange(1000.0), scene)})
+    assert graph['computed'] == {'scaled': 3}
+    assert graph['bytes'] <= 10000
+
+    clear_memory(graph)
+    evaluate(graph, 'scaled', PARAMS, {'load': (np.arange(10.0), 'c')})
+    evaluate(graph, 'scaled', PARAMS, {'load': (np.arange(10.0), 'c')})
+    assert graph['computed'] == {'scaled': 4}
@@ -0,0 +1,18 @@
+import numpy as np
+
+from frame_store import iter_frame_dicts
+from trajectory_store import build_trajectory_store, concat_stores, filter_samples
+from transpose import frames_from_trajectories
+
+
+def test_mixed_car_ids_are_kept():
+    cars = [{'_id': {'$oid': 'abc'}, 'timestamp': [1.0, 1.04], 'x_position': [0.0, 1.0],
+             'y_position': [6.0, 6.0]},
+            {'_id': 1, 'timestamp': [1.0, 1.04], 'x_position': [5.0, 6.0],
+             'y_position': [18.0, 18.0]}]
+    store = build_trajectory_store(cars)
+    assert store['ids'] == ['abc', 1]
+
+    assert filter_samples(store, np.ones(4, dtype=bool))['ids'] == ['abc', 1]
+    assert concat_stores([store, store])['ids'] == ['abc', 1, 'abc', 1]
+    assert next(iter_frame_dicts(frames_from_trajectories(store)))['ids'] == ['abc', 1]
@@ -0,0 +1,129 @@
+from array import array
+import hashlib
+import json
+import numpy as np
+
+
+# returns the id of a car trajectory as a string, whether it is stored as a plain string or as a
+# mongo-style {'$oid': ...} dictionary
+def get_car_id(data_set, default=None):
+    car_id = data_set.get('_id', default)
+    if isinstance(car_id, dict):
+        car_id = list(car_id.values())[0]
+    return car_id
+
+
+# builds a columnar store out of car trajectories. timestamp, x and y positions of all cars are
+# concatenated into contiguous float64 arrays, and car i occupies offsets[i]:offsets[i+1]
+def build_trajectory_store(data):
+    ids = []
+    lengths = [0]
+    timestamp, x, y = array('d'), array('d'), array('d')
+
+    for data_set in data:
+        ids.append(get_car_id(data_set, len(ids)))
+        timestamp.extend(data_set['timestamp'])
+        x.extend(data_set['x_position'])
+        y.extend(data_set['y_position'])
+        lengths.append(len(data_set['timestamp']))
+
+    return {
+        'ids': ids,
+        'offsets': np.cumsum(lengths, dtype=np.int64),
+        'timestamp': np.frombuffer(timestamp, dtype=np.float64),
+        'x': np.frombuffer(x, dtype=np.float64),
+        'y': np.frombuffer(y, dtype=np.float64),
+    }
+
+
+# returns a copy of data if it already is a trajectory store, such as one loaded by scene_cache,
+# and otherwise builds one from the car trajectories in data. the copy shares its columns with
+# data, so adding columns to it leaves data as it was
+def as_trajectory_store(data):
+    if isinstance(data, dict) and 'offsets' in data:
+        return dict(data)
+    return build_trajectory_store(data)
+
+
+# returns a hash of the car ids and columns of a store, identifying its content
+def store_key(store):
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps([str(car_id) for car_id in store['ids']]).encode())
+    for name in 'offsets', 'timestamp', 'x', 'y':
+        digest.update(np.ascontiguousarray(store[name]))
+    return digest.hexdigest()
+
+
+# number of car trajectories in the store
+def num_cars(store):
+    return len(store['offsets']) - 1
+
+
+# returns a boolean array marking the first `n` samples of every trajectory
+def trajectory_heads(store, n=1):
+    offsets = store['offsets']
+    heads = np.zeros(len(store['timestamp']), dtype=bool)
+    for i in range(n):
+        starts = offsets[:-1] + i
+        heads[starts[starts < offsets[1:]]] = True
+    return heads
+
+
+# returns the index of the car each sample belongs to
+def car_index(store):
+    return np.repeat(np.arange(num_cars(store)), np.diff(store['offsets']))
+
+
+# returns the store of cars first to last (exclusive) of the store, as views of its arrays
+def slice_store(store, first, last):
+    offsets = store['offsets']
+    lo, hi = offsets[first], offsets[last]
+    return {
+        'ids': store['ids'][first:last],
+        'offsets': offsets[first:last+1] - lo,
+        'timestamp': store['timestamp'][lo:hi],
+        'x': store['x'][lo:hi],
+        'y': store['y'][lo:hi],
+    }
+
+
+# splits the cars of the store into up to `shards` ranges of consecutive cars with about the same
+# number of samples each, returned as (first, last) pairs
+def shard_bounds(store, shards):
+    offsets = store['offsets']
+    bounds = np.searchsorted(offsets, np.linspace(0, offsets[-1], shards+1), side='left')
+    bounds[0], bounds[-1] = 0, num_cars(store)
+    bounds = np.unique(bounds)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+# joins stores of different cars into one, the cars of each store after those of the previous one
+def concat_stores(stores):
+    if not stores:
+        return build_trajectory_store([])
+    lengths = np.concatenate([np.diff(store['offsets']) for store in stores])
+    return {
+        'ids': [car_id for store in stores for car_id in store['ids']],
+        'offsets': np.append(0, np.cumsum(lengths)).astype(np.int64),
+        'timestamp': np.concatenate([store['timestamp'] for store in stores]),
+        'x': np.concatenate([store['x'] for store in stores]),
+        'y': np.concatenate([store['y'] for store in stores]),
+    }
+
+
+# returns the store of the samples marked in keep, leaving out the cars with fewer than min_samples
+# of them
+def filter_samples(store, keep, min_samples=1):
+    car = car_index(store)
+    lengths = np.bincount(car[keep], minlength=num_cars(store))
+    kept = lengths >= max(min_samples, 1)
+    keep = keep & kept[car]
+    ids = [store['ids'][i] for i in np.flatnonzero(kept)]
+    lengths = lengths[kept]
+    return {
+        'ids': ids,
+        'offsets': np.append(0, np.cumsum(lengths)).astype(np.int64),
+        'timestamp': store['timestamp'][keep],
+        'x': store['x'][keep],
+        'y': store['y'][keep],
+    }
@@ -0,0 +1,38 @@
+import numpy as np
+
+from frame_store import num_frames
+from trajectory_store import car_index
+
+
+# pivots a trajectory store into a frame store, grouping the samples of all cars by timestamp.
+# frames come out in time order, and the cars within a frame in their order in the trajectory store
+def frames_from_trajectories(store):
+    order = np.argsort(store['timestamp'], kind='stable')
+    timestamp = store['timestamp'][order]
+    starts = np.flatnonzero(np.append(True, timestamp[1:] != timestamp[:-1])[:len(timestamp)])
+
+    return {
+        'ids': store['ids'],
+        'offsets': np.append(starts, len(timestamp)).astype(np.int64),
+        'timestamp': timestamp[starts],
+        'x': store['x'][order],
+        'y': store['y'][order],
+        'car': car_index(store)[order].astype(np.int32),
+    }
+
+
+# pivots a frame store into a trajectory store, grouping the positions of every frame by car. the
+# samples of each car come out in time order
+def trajectories_from_frames(store):
+    frame = np.repeat(np.arange(num_frames(store)), np.diff(store['offsets']))
+    timestamp = store['timestamp'][frame]
+    order = np.lexsort((timestamp, store['car']))
+    lengths = np.bincount(store['car'], minlength=len(store['ids']))
+
+    return {
+        'ids': store['ids'],
+        'offsets': np.append(0, np.cumsum(lengths)).astype(np.int64),
+        'timestamp': timestamp[order],
+        'x': store['x'][order],
+        'y': store['y'][order],
+    }